@@ -1,121 +1,137 @@
 #!/usr/bin/env python3
 
+import time
+
+from pathlib import Path
+
+import click
 import numpy as np
-from scipy.interpolate import interp1d
-from scipy.optimize import fsolve, newton, curve_fit
-from scipy.special import binom
+from scipy.interpolate import interp1d, PchipInterpolator
+from scipy.optimize import curve_fit
 
-import matplotlib.pyplot as plt
+HERE = Path(__file__).parent
 
-vgn1_curve = np.loadtxt("VGN1@VGN20.csv", delimiter=',')
-vgn2_curve = np.loadtxt("VGN2@VGN1_1.5.csv", delimiter=',')
 
-idx = np.argsort(vgn1_curve[:,0])
+def load_curve(path):
+    curve = np.loadtxt(path, delimiter=',')
 
-vgn1_curve = vgn1_curve[idx]
+    idx = np.argsort(curve[:,0])
 
-vgn1 = interp1d(vgn1_curve[:,0], vgn1_curve[:,1], fill_value="extrapolate")
+    return curve[idx]
 
-idx = np.argsort(vgn2_curve[:,0])
 
-vgn2_curve = vgn2_curve[idx]
+def combined_gain(vgn1_path, vgn2_path):
+    # Gain vs. control voltage with VGN1 and VGN2 driven together,
+    # relative to the gain at 0V
+    vgn1_curve = load_curve(vgn1_path)
+    vgn2_curve = load_curve(vgn2_path)
 
-vgn2_curve[:,1] -= vgn1(1.5)
+    vgn1 = interp1d(vgn1_curve[:,0], vgn1_curve[:,1], fill_value="extrapolate")
 
-vgn2 = interp1d(vgn2_curve[:,0], vgn2_curve[:,1], fill_value="extrapolate")
+    # VGN2 was measured with VGN1 at 1.5V
+    vgn2_curve[:,1] -= vgn1(1.5)
 
+    vgn2 = interp1d(vgn2_curve[:,0], vgn2_curve[:,1], fill_value="extrapolate")
 
-x = np.linspace(0, 1.5, 100)
+    return lambda x: vgn1(x) + vgn2(x) - vgn1(0)
 
-if False:
-    plt.plot(x, vgn1(x))
-    plt.plot(x, vgn2(x))
-    
-    plt.plot(x, vgn1(x) + vgn2(x)-vgn1(0))
-    
-    plt.xticks(np.arange(0, 1.51, 0.1))
-    plt.yticks(np.arange(-10, 61, 5))
-    
-    plt.grid()
-    
-    plt.show()
 
-def richards(t, A, B, K, Q):
-    C = 1
-    nu = 1
-    return A + (K - A)/(C+Q*np.exp(-B*t))**(1/nu)
+def f(t, *args):
+    retval = 0
 
-max_gain = vgn1(1.5) + vgn2(1.5) - vgn1(0)
+    for i, c in enumerate(args):
+        retval += c * t**(i+1)
 
-@np.vectorize
-def SN(t, N):
-    t = t / 1.5
+    return retval
 
-    if t < 0:
-        return 0
 
-    if t > 1:
-        return max_gain
+def fit(gain, v_max):
+    # Smooth the measured curve with a 9th order polynomial through the
+    # origin, as the original table was built
+    x = np.linspace(0, v_max, 100)
 
-    retval = 0
-    
-    for n in range(N+1):
-        retval += binom(-N-1, n) * binom(2 * N + 1, N - n) * t**(N + n + 1)
+    popt, pcov = curve_fit(f, x, gain(x), [
+        6.73992332,
+        -148.29699193,
+        992.3236711,
+        -1175.36635491,
+        -1369.00052319,
+        4652.37169521,
+        -4608.26945438,
+        2049.95556908,
+        -348.93151547
+    ])
 
-    print(retval)
-        
-    return retval * max_gain
+    return lambda x: f(x, *popt)
 
-def f(t, *args):
-    retval = 0
-    
-    for i, c in enumerate(args):
-        retval += c * t**(i+1)
 
-    return retval
+def inverse(gain, v_max, samples):
+    # Sample the curve densely, force it monotone and fit a monotone
+    # spline through (gain, voltage), which is the inverse we are after
+    v = np.linspace(0, v_max, samples)
+    g = np.maximum.accumulate(gain(v))
+
+    # Flat stretches would make the inverse multi-valued; keep the
+    # lowest voltage reaching each gain
+    g, idx = np.unique(g, return_index=True)
+
+    return PchipInterpolator(g, v[idx]), g[0], g[-1]
+
+
+def decimals(step):
+    return max(1, int(np.ceil(-np.log10(step) - 1e-9)))
+
+
+@click.command()
+@click.option("--step", default=0.5, help="Gain step of the table in dB")
+@click.option("--max-gain", default=60.0, help="Highest gain in the table in dB")
+@click.option("--v-max", default=1.5, help="Top of the control voltage range")
+@click.option("--samples", default=20001, help="Points the curve is sampled at before inverting")
+@click.option("--precision", default=3, help="Decimal places of the voltage column")
+@click.option("--raw", is_flag=True, help="Invert the measured curve instead of the polynomial fit")
+@click.option("--vgn1", default=str(HERE / "VGN1@VGN20.csv"), help="VGN1 sweep with VGN2 at 0V")
+@click.option("--vgn2", default=str(HERE / "VGN2@VGN1_1.5.csv"), help="VGN2 sweep with VGN1 at 1.5V")
+@click.option("--output", "-o", default=str(HERE / "gain_lookup.csv"), help="Table to write")
+@click.option("--plot", is_flag=True, help="Plot the curve and the table")
+def combine(step, max_gain, v_max, samples, precision, raw, vgn1, vgn2, output, plot):
+    start = time.monotonic()
+
+    gain = combined_gain(vgn1, vgn2)
+
+    if not raw:
+        gain = fit(gain, v_max)
+
+    voltage, bottom, top = inverse(gain, v_max, samples)
 
-popt, pcov = curve_fit(f, x, vgn1(x) + vgn2(x)-vgn1(0), [
-    6.73992332,
-    -148.29699193,
-    992.3236711,
-    -1175.36635491,
-    -1369.00052319,
-    4652.37169521,
-    -4608.26945438,
-    2049.95556908,
-    -348.93151547
-])
+    if top < max_gain:
+        print(f"Curve tops out at {top:.3f}dB, table stops there")
+        max_gain = top
 
-plt.plot(x, vgn1(x) + vgn2(x)-vgn1(0))
-plt.plot(x, f(x, *popt))
+    x = np.arange(0, max_gain + step / 2, step)
+    x = x[x <= max_gain]
 
-print(popt)
-#print(pcov)
-print(np.linalg.cond(pcov))
+    # Gains below the bottom of the curve map to 0V
+    y = np.round(voltage(np.clip(x, bottom, top)), decimals=precision)
 
-@np.vectorize
-def getr(xp):
-    r = np.roots(np.flip(np.concatenate(([-xp], popt))))
+    gd = decimals(step)
 
-    r = np.real(r[np.isreal(r) & (r >= 0) & (r < 1.5)])[0]
-    
-    return r
+    with open(output, "w") as f:
+        f.writelines(f"{a:.{gd}f},{b:.{precision}f}\n" for a, b in zip(x, y))
 
-x = np.arange(0, 60.5, 0.5)
+    print(f"Wrote {len(x)} points to {output} in {time.monotonic() - start:.3f}s")
 
-print(x)
-print(np.round(getr(x), decimals=3))
+    if plot:
+        import matplotlib.pyplot as plt
 
-with open("gain_lookup.csv", "w") as f:
-    for x, y in  zip(x, np.round(getr(x), decimals=3)):
-        f.write(f"{x},{y:.3f}\n")
-    
-plt.figure()
-plt.plot(x, getr(x))
+        v = np.linspace(0, v_max, 200)
 
-y = np.arange(0, 1.5, 0.1)
+        plt.plot(gain(v), v)
+        plt.plot(x, y, '.')
+        plt.xlabel("Gain (dB)")
+        plt.ylabel("Control voltage (V)")
+        plt.grid()
+        plt.show()
 
-plt.plot(vgn1(y)+vgn2(y)-vgn1(0), y)
 
-plt.show()
-    
+if __name__ == '__main__':
+    combine()
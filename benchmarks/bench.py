@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""Benchmarks of the retune, calibration and RPC paths.
+
+Everything runs against the simulated board (kalpanactl.sim) with its
+calibration times and the reference settle time set to zero, so the
+numbers are the software's own cost and repeat from run to run.
+Results are written out as JSON for comparing releases:
+
+    python benchmarks/bench.py -o bench-0.1.0.json
+"""
+import atexit
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tomllib
+import urllib.request
+
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Kalpana reads its configuration path when it is imported, so the
+# environment has to be in place first
+_conf_dir = tempfile.mkdtemp(prefix="kalpana-bench-")
+atexit.register(shutil.rmtree, _conf_dir, ignore_errors=True)
+
+os.environ["KALPANA_BACKEND"] = "sim"
+os.environ["KALPANA_CONF"] = os.path.join(_conf_dir, "kalpana.conf")
+
+with open(os.environ["KALPANA_CONF"], "w") as f:
+    json.dump({ 'backend': "sim", 'ref_settle': 0.0 }, f)
+
+sys.path.insert(0, str(ROOT))
+
+import click
+import rpyc
+
+from rpyc.utils.server import ThreadedServer
+from werkzeug.serving import make_server
+
+from kalpanactl import kalpanactld
+from kalpanactl import log as kalpana_log
+from kalpanactl.backend import get_backend
+from kalpanactl.lmx2820 import LMX2820
+from kalpanactl.ltc5594 import LTC5594
+from kalpanactl.sim import SimLMX2820
+
+# No hardware sleeps
+SimLMX2820.CAL_TIME = 0
+SimLMX2820.INSTACAL_TIME = 0
+
+
+def grid(points):
+    # LO range with a fractional step, so planning works for its N/frac
+    step = (4.4e9 - 400e6) / points
+    return [ 400e6 + i * step for i in range(points) ]
+
+
+def stats(samples):
+    # Per-call times in ns to summary statistics in us
+    samples = sorted(samples)
+    n = len(samples)
+
+    return {
+        'n': n,
+        'mean_us': statistics.fmean(samples) / 1e3,
+        'min_us': samples[0] / 1e3,
+        'p50_us': samples[n // 2] / 1e3,
+        'p90_us': samples[int(n * 0.9)] / 1e3,
+        'p99_us': samples[int(n * 0.99)] / 1e3,
+        'max_us': samples[-1] / 1e3,
+        'ops_per_s': n / (sum(samples) / 1e9),
+    }
+
+
+def measure(fn, args, warmup=10):
+    # Times fn(arg) for every arg
+    for a in args[:warmup]:
+        fn(a)
+
+    samples = []
+
+    for a in args:
+        start = time.perf_counter_ns()
+        fn(a)
+        samples.append(time.perf_counter_ns() - start)
+
+    return stats(samples)
+
+
+class SPICounter:
+    """Frames and bytes a simulated chip saw over a number of calls."""
+    def __init__(self, spi):
+        self._spi = spi
+        self.calls = 0
+        self._start = (spi.frames, spi.bytes)
+
+    def __call__(self, fn, *args):
+        self.calls += 1
+        return fn(*args)
+
+    def result(self):
+        frames = self._spi.frames - self._start[0]
+        nbytes = self._spi.bytes - self._start[1]
+
+        return {
+            'calls': self.calls,
+            'frames': frames,
+            'bytes': nbytes,
+            'frames_per_call': frames / self.calls,
+            'bytes_per_call': nbytes / self.calls,
+        }
+
+
+def bench_plan(freqs):
+    backend = get_backend()
+    retval = {}
+
+    # A cache that cannot hold anything plans every call from scratch
+    lmx = LMX2820(backend.spi("bench-plan-cold", "lmx2820"), plan_cache_size=0)
+    retval['uncached'] = measure(lmx.set_fout, freqs)
+
+    lmx = LMX2820(backend.spi("bench-plan-warm", "lmx2820"), plan_cache_size=len(freqs))
+    lmx.preload(freqs)
+    retval['cached'] = measure(lmx.set_fout, freqs)
+
+    return retval
+
+
+def bench_program(freqs):
+    backend = get_backend()
+    retval = {}
+
+    spi = backend.spi("bench-program-lmx", "lmx2820")
+    lmx = LMX2820(spi)
+
+    count = SPICounter(spi)
+    for f in freqs:
+        lmx.set_fout(f)
+        count(lmx.program, True)
+    retval['lmx2820_full'] = count.result()
+
+    count = SPICounter(spi)
+    for f in freqs:
+        lmx.set_fout(f)
+        count(lmx.program)
+    retval['lmx2820_retune'] = count.result()
+
+    count = SPICounter(spi)
+    for f in freqs:
+        count(lmx.program)
+    retval['lmx2820_unchanged'] = count.result()
+
+    spi = backend.spi("bench-program-ltc", "ltc5594")
+    ltc = LTC5594(spi)
+
+    count = SPICounter(spi)
+    for i, f in enumerate(freqs):
+        ltc.set_freq(f)
+        ltc.set_i_gain((i % 64) / 64 - 0.5)
+        ltc.set_phase_offset((i % 50) / 10 - 2.5)
+        count(ltc.program)
+    retval['ltc5594_retune'] = count.result()
+
+    count = SPICounter(spi)
+    for f in freqs:
+        count(ltc.program)
+    retval['ltc5594_unchanged'] = count.result()
+
+    return retval
+
+
+def bench_set_lo(kalpana, freqs):
+    retval = {
+        'set_a_LO': measure(kalpana.set_a_LO, freqs),
+        'set_b_LO': measure(kalpana.set_b_LO, freqs),
+        'set_LOs': measure(lambda f: kalpana.set_LOs(f, f), freqs),
+    }
+
+    kalpana.flush_config()
+
+    return retval
+
+
+def bench_hop(kalpana, freqs, hops):
+    hop_freqs = freqs[::len(freqs) // hops][:hops]
+
+    start = time.perf_counter_ns()
+    kalpana.set_hop_list('a', hop_freqs)
+    calibrate = time.perf_counter_ns() - start
+
+    retval = {
+        'hops': len(hop_freqs),
+        'set_hop_list_us': calibrate / 1e3,
+        'hop': measure(lambda i: kalpana.hop('a', i % len(hop_freqs)), list(range(len(freqs)))),
+    }
+
+    kalpana.flush_config()
+
+    return retval
+
+
+def bench_ltc5594(n):
+    ltc = LTC5594(get_backend().spi("bench-ltc5594", "ltc5594"))
+    freqs = grid(n)
+
+    return {
+        'set_freq': measure(ltc.set_freq, freqs),
+        'set_i_gain': measure(ltc.set_i_gain, [ (i % 64) / 64 - 0.5 for i in range(n) ]),
+        'set_phase_offset': measure(ltc.set_phase_offset, [ (i % 50) / 10 - 2.5 for i in range(n) ]),
+        'set_dc_offset': measure(lambda v: ltc.set_dc_offset("I", v), [ (i % 400) - 200 for i in range(n) ]),
+    }
+
+
+def bench_rpyc(freqs, n):
+    server = ThreadedServer(kalpanactld.KalpanaCtlService, hostname="localhost", port=0,
+                            protocol_config={ 'allow_public_attrs': True })
+    threading.Thread(target=server.start, daemon=True).start()
+
+    # start() only starts listening once it runs
+    while not server.active:
+        time.sleep(0.001)
+
+    conn = rpyc.connect("localhost", server.port)
+
+    try:
+        retval = {
+            'get_a_LO': measure(lambda _: conn.root.get_a_LO(), list(range(n))),
+            'set_a_LO': measure(conn.root.set_a_LO, freqs),
+            'get_state': measure(lambda _: conn.root.get_state(), list(range(n))),
+        }
+    finally:
+        conn.close()
+        server.close()
+
+    return retval
+
+
+def bench_rest(freqs, n):
+    server = make_server("localhost", 0, kalpanactld.flask_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    url = f"http://localhost:{server.server_port}"
+
+    def get(path, method="GET"):
+        with urllib.request.urlopen(urllib.request.Request(url + path, method=method)) as r:
+            return r.read()
+
+    try:
+        retval = {
+            'get_a_lo': measure(lambda _: get("/a_lo"), list(range(n))),
+            'put_a_lo': measure(lambda f: get(f"/a_lo?freq={f}", "PUT"), freqs),
+            'get_state': measure(lambda _: get("/state"), list(range(n))),
+        }
+    finally:
+        server.shutdown()
+
+    return retval
+
+
+def metadata(points, calls):
+    with open(ROOT / "pyproject.toml", "rb") as f:
+        version = tomllib.load(f)['tool']['poetry']['version']
+
+    try:
+        commit = subprocess.run([ "git", "rev-parse", "HEAD" ], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'version': version,
+        'commit': commit,
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'points': points,
+        'calls': calls,
+    }
+
+
+BENCHMARKS = ( 'plan', 'program', 'set_lo', 'hop', 'ltc5594', 'rpyc', 'rest' )
+
+
+@click.command()
+@click.option("-o", "--output", type=click.File("w"), default="-", help="Where to write the JSON results")
+@click.option("--points", default=400, help="Frequencies in the LO grid")
+@click.option("--calls", default=2000, help="Calls per benchmark that take no frequency")
+@click.option("--hops", default=8, help="Hop frequencies to calibrate")
+@click.option("--only", multiple=True, type=click.Choice(BENCHMARKS), help="Run just these, repeatable")
+@click.option("--log-level", default="WARNING", help="Level the daemon logs at while benchmarked")
+def bench(output, points, calls, hops, only, log_level):
+    # The REST server would otherwise log every request
+    kalpana_log.setup(level=log_level, levels={ 'werkzeug': "WARNING" })
+
+    freqs = grid(points)
+    only = only or BENCHMARKS
+
+    results = {}
+
+    if { 'set_lo', 'hop', 'rpyc', 'rest' } & set(only):
+        kalpanactld.setup()
+
+    for name in only:
+        click.echo(f"Running {name}", err=True)
+
+        if name == 'plan':
+            results[name] = bench_plan(freqs)
+        elif name == 'program':
+            results[name] = bench_program(freqs)
+        elif name == 'set_lo':
+            results[name] = bench_set_lo(kalpanactld.kalpana, freqs)
+        elif name == 'hop':
+            results[name] = bench_hop(kalpanactld.kalpana, freqs, hops)
+        elif name == 'ltc5594':
+            results[name] = bench_ltc5594(calls)
+        elif name == 'rpyc':
+            results[name] = bench_rpyc(freqs, calls)
+        elif name == 'rest':
+            results[name] = bench_rest(freqs, calls)
+
+    json.dump({ 'meta': metadata(points, calls), 'results': results }, output, indent=2)
+    output.write("\n")
+
+
+if __name__ == '__main__':
+    bench()
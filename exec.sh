@@ -3,4 +3,4 @@ DIR=$(dirname $(realpath "$0"))
 cd ${DIR}
 echo "Hello ${DIR}"
 export PYTHONPATH=${DIR}
-BOKEH_ALLOW_WS_ORIGIN=*.*.*.*:5006 /usr/bin/poetry run -vvv python kalpanactl/kalpanactld.py > /tmp/kalpana-log
+BOKEH_ALLOW_WS_ORIGIN=*.*.*.*:5006 /usr/bin/poetry run -vvv python kalpanactl/kalpanactld.py --log-file /tmp/kalpana-log
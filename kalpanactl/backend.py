@@ -0,0 +1,46 @@
+import importlib
+import os
+
+
+class PeripheryBackend:
+    """The board's spidev and gpiochip nodes through python-periphery,
+    which is only imported once a device is opened."""
+    def spi(self, path, chip, mode=0, max_speed=1000000):
+        # chip names the part behind the node; only the simulator uses it
+        from periphery import SPI
+
+        return SPI(path, mode, max_speed)
+
+    def gpio(self, path, line, direction):
+        from periphery import GPIO
+
+        return GPIO(path, line, direction)
+
+
+BACKENDS = {
+    'periphery': ( 'kalpanactl.backend', 'PeripheryBackend' ),
+    'sim': ( 'kalpanactl.sim', 'SimBackend' ),
+}
+
+_instances = {}
+
+
+def get_backend(name=None, default="periphery"):
+    """Returns the backend called name, else the one named by the
+    KALPANA_BACKEND environment variable, else default.  There is one
+    instance per backend, so everything opened through the simulator
+    sees the same simulated chips."""
+    name = name or os.environ.get("KALPANA_BACKEND") or default
+
+    try:
+        return _instances[name]
+    except KeyError:
+        pass
+
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name}, options are {', '.join(BACKENDS)}")
+
+    module, cls = BACKENDS[name]
+    backend = _instances[name] = getattr(importlib.import_module(module), cls)()
+
+    return backend
@@ -0,0 +1,45 @@
+import numpy as np
+
+
+class CalibrationTable:
+    """IQ and DC offset corrections measured at a set of LO frequencies.
+
+    Rows are (frequency, i_gain, phase_offset, i_dc_offset, q_dc_offset)
+    kept sorted by frequency.  lookup() interpolates linearly between the
+    measured points and holds the end values outside of them.
+    """
+    COLUMNS = ( 'i_gain', 'phase_offset', 'i_dc_offset', 'q_dc_offset' )
+
+    def __init__(self, rows=()):
+        rows = np.array(rows, dtype=float).reshape(-1, 1 + len(self.COLUMNS))
+        rows = rows[np.argsort(rows[:,0])]
+
+        self._freqs = rows[:,0]
+        self._values = rows[:,1:]
+
+    def __len__(self):
+        return len(self._freqs)
+
+    def rows(self):
+        return np.column_stack((self._freqs, self._values)).tolist()
+
+    def insert(self, f, i_gain, phase_offset, i_dc_offset, q_dc_offset):
+        values = [ i_gain, phase_offset, i_dc_offset, q_dc_offset ]
+
+        i = np.searchsorted(self._freqs, f)
+
+        if i < len(self._freqs) and self._freqs[i] == f:
+            self._values[i] = values
+        else:
+            self._freqs = np.insert(self._freqs, i, f)
+            self._values = np.insert(self._values, i, values, axis=0)
+
+    def clear(self):
+        self._freqs = self._freqs[:0]
+        self._values = self._values[:0]
+
+    def lookup(self, f):
+        assert len(self._freqs) > 0, "Empty calibration table"
+
+        return tuple(float(np.interp(f, self._freqs, self._values[:,c]))
+                     for c in range(len(self.COLUMNS)))
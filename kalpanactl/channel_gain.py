@@ -21,20 +21,62 @@ class ADRFGainTable:
         1.091, 1.104, 1.117, 1.132, 1.148, 1.167, 1.190, 1.220,
         1.276, ])
 
-    assert len(xx) == len(yy)
+    # Channels in the order channel_voltages() takes and returns them
+    CHANNELS = ( 'rx0', 'rx1', 'tx0', 'tx1' )
+
+    def __init__(self, xx=None, yy=None):
+        # Defaults to the table above; pass xx/yy for a per-board curve
+        if xx is not None:
+            self.xx = np.asarray(xx, dtype=float)
+            self.yy = np.asarray(yy, dtype=float)
+
+        assert len(self.xx) == len(self.yy)
+        assert np.all(np.diff(self.xx) > 0) and np.all(np.diff(self.yy) >= 0), "Gain curve must be monotone"
 
     @classmethod
-    def gain_to_voltage(cls, gain):
-        assert gain >=  0 and gain <= 60, f"Gain ({gain}) must be between 0 and 60 inclusive"
-        
-        for i, x in enumerate(cls.xx):
-            if x > gain:
-                break
+    def from_csv(cls, path):
+        # gain,voltage rows as written by ADRF6520GainCurve/combine.py
+        table = np.loadtxt(path, delimiter=',', ndmin=2)
+
+        return cls(table[:,0], table[:,1])
+
+    @property
+    def gain_range(self):
+        return self.xx[0], self.xx[-1]
+
+    @property
+    def voltage_range(self):
+        return self.yy[0], self.yy[-1]
+
+    @staticmethod
+    def _result(v):
+        return float(v) if np.ndim(v) == 0 else v
+
+    def gain_to_voltage(self, gain):
+        # Takes a scalar or an array of gains in dB
+        g = np.asarray(gain, dtype=float)
+        lo, hi = self.gain_range
+
+        assert np.all((g >= lo) & (g <= hi)), f"Gain ({gain}) must be between {lo} and {hi} inclusive"
+
+        return self._result(np.interp(g, self.xx, self.yy))
+
+    def voltage_to_gain(self, voltage):
+        v = np.asarray(voltage, dtype=float)
+        lo, hi = self.voltage_range
+
+        assert np.all((v >= lo) & (v <= hi)), f"Voltage ({voltage}) must be between {lo} and {hi} inclusive"
+
+        return self._result(np.interp(v, self.yy, self.xx))
+
+    def channel_voltages(self, gains):
+        # Converts gains for several ADRF6520 channels in one go.  Takes
+        # a dict keyed by channel name, or four gains in CHANNELS order.
+        if isinstance(gains, dict):
+            assert all(c in self.CHANNELS for c in gains), f"Channels must be among {self.CHANNELS}"
 
-        x0 = cls.xx[i-1]
-        x1 = cls.xx[i]
-        y0 = cls.yy[i-1]
-        y1 = cls.yy[i]
+            return dict(zip(gains, self.gain_to_voltage(list(gains.values())).tolist()))
 
-        return (gain - x0) / (x1 - x0) * (y1 - y0) + y0
+        assert len(gains) == len(self.CHANNELS)
 
+        return self.gain_to_voltage(gains)
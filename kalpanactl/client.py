@@ -0,0 +1,187 @@
+import logging
+import queue
+import threading
+import time
+
+from json import loads
+
+import rpyc
+
+log = logging.getLogger(__name__)
+
+
+class KalpanaClient:
+    """A small pool of rpyc connections to kalpanactld, shared by any
+    number of threads (e.g. one per browser session):
+
+        client = KalpanaClient()
+        client.set_a_LO(2.4e9)
+
+    Each call goes out once on an idle connection.  If that connection
+    turns out to be dead the call is retried once on a fresh one, which
+    is safe because the daemon's setters only ever set absolute values.
+    A background thread pings idle connections every heartbeat seconds
+    and drops the ones that stopped answering, so a restarted daemon is
+    usually noticed before anyone calls into it.
+
+    subscribe() registers callbacks for the changes the daemon pushes.
+    They all share one extra connection, which the heartbeat also
+    watches.  After a reconnect the subscribers get the full state, to
+    make up for anything missed in between.
+    """
+    def __init__(self, host="localhost", port=37000, size=4, heartbeat=5.0):
+        self._host = host
+        self._port = port
+        self._heartbeat = heartbeat
+
+        self._idle = queue.LifoQueue()
+
+        # Connections that may still be opened
+        self._slots = threading.Semaphore(size)
+
+        self._subscribers = []
+        self._events = None
+        self._events_lock = threading.Lock()
+
+        self._thread = threading.Thread(target=self._run, name="kalpana-heartbeat", daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        return rpyc.connect(self._host, self._port)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        # Open a new connection if the pool has room, otherwise wait for
+        # another caller to hand one back
+        if self._slots.acquire(blocking=False):
+            try:
+                return self._connect()
+            except BaseException:
+                self._slots.release()
+                raise
+
+        return self._idle.get()
+
+    def _release(self, conn):
+        self._idle.put(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _discard(self, conn):
+        self._close(conn)
+        self._slots.release()
+
+    def call(self, name, *args):
+        for attempt in range(2):
+            conn = self._acquire()
+
+            try:
+                retval = getattr(conn.root, name)(*args)
+            except (EOFError, ConnectionError):
+                self._discard(conn)
+
+                if attempt:
+                    raise
+
+                continue
+            except BaseException:
+                self._release(conn)
+                raise
+
+            self._release(conn)
+
+            return retval
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        return lambda *args: self.call(name, *args)
+
+    def subscribe(self, callback):
+        # callback(delta) is called from a background thread with each
+        # change, as a dict in get_state() form
+        with self._events_lock:
+            self._subscribers = self._subscribers + [ callback ]
+
+            if self._events is None:
+                self._listen()
+
+    def unsubscribe(self, callback):
+        with self._events_lock:
+            self._subscribers = [ s for s in self._subscribers if s != callback ]
+
+            if not self._subscribers and self._events is not None:
+                self._close(self._events)
+                self._events = None
+
+    def _listen(self, resync=False):
+        # Served in the background so the daemon can call back into it
+        conn = self._connect()
+        rpyc.BgServingThread(conn)
+        conn.root.subscribe(self._deliver)
+
+        self._events = conn
+
+        if resync:
+            self._deliver(conn.root.get_state())
+
+    def _deliver(self, delta):
+        delta = loads(delta)
+
+        for callback in self._subscribers:
+            try:
+                callback(delta)
+            except Exception as e:
+                log.warning(f"Failed to deliver {delta} to {callback}: {e!r}")
+
+    def _check_events(self):
+        with self._events_lock:
+            if not self._subscribers:
+                return
+
+            if self._events is not None:
+                try:
+                    self._events.root.keep_alive()
+                    return
+                except Exception:
+                    self._close(self._events)
+                    self._events = None
+
+            try:
+                self._listen(resync=True)
+            except (EOFError, ConnectionError):
+                pass
+
+    def _run(self):
+        while True:
+            time.sleep(self._heartbeat)
+
+            # Only idle connections are pinged, busy ones prove
+            # themselves alive anyway
+            idle = []
+
+            while True:
+                try:
+                    idle.append(self._idle.get_nowait())
+                except queue.Empty:
+                    break
+
+            for conn in idle:
+                try:
+                    conn.root.keep_alive()
+                except Exception:
+                    self._discard(conn)
+                else:
+                    self._release(conn)
+
+            self._check_events()
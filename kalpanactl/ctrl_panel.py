@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
+import logging
 import sys
 
+from functools import partial
+from json import loads
 from pathlib import Path
 
 import numpy as np
@@ -9,13 +12,20 @@ from matplotlib.figure import Figure
 
 import panel as pn
 
-import rpyc
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from kalpanactl.client import KalpanaClient
+from kalpanactl import log as kalpana_log
+
+log = logging.getLogger("ctrl_panel")
 
 pn.extension(sizing_mode="stretch_width")
 
 class KalpanaWebPanel:
-    def __init__(self):
-        self.conn = rpyc.connect('localhost', 37000)
+    def __init__(self, srv):
+        # One panel per browser session, all sharing srv's connections
+        self.srv = srv
+
+        state = loads(self.srv.get_state())
     
         ACCENT="goldenrod"
         LOGO="assets/pi-radio.png"
@@ -25,7 +35,7 @@ class KalpanaWebPanel:
         ax.hist(data, bins=20, color=ACCENT)
 
         a_LO = pn.widgets.EditableFloatSlider(
-            value=self.srv.get_a_LO()/1e9,
+            value=state['f_a_lo']/1e9,
             step=0.1,
             start=0.4,
             end=4.4,
@@ -36,7 +46,7 @@ class KalpanaWebPanel:
             name="Frequency A (GHz)")
 
         b_LO = pn.widgets.EditableFloatSlider(
-            value=self.srv.get_b_LO()/1e9,
+            value=state['f_b_lo']/1e9,
             step=0.1,
             start=0.4,
             end=4.4,
@@ -47,7 +57,7 @@ class KalpanaWebPanel:
             name="Frequency B (GHz)")
 
         tx_i_gain = pn.widgets.EditableFloatSlider(
-            value=self.srv.get_i_gain('tx'),
+            value=state['tx_i_gain'],
             step=0.01,
             start=-0.5,
             end=0.5,
@@ -58,7 +68,7 @@ class KalpanaWebPanel:
             name="Channel TX: I over Q  gain (dB) for sideband suppression")
 
         rx_i_gain = pn.widgets.EditableFloatSlider(
-            value=self.srv.get_i_gain('rx'),
+            value=state['rx_i_gain'],
             step=0.01,
             start=-0.5,
             end=0.5,
@@ -69,7 +79,7 @@ class KalpanaWebPanel:
             name="Channel RX: I over Q  gain (dB) for sideband suppression")
 
         tx_i_dc_offset = pn.widgets.EditableFloatSlider(
-            value=self.srv.get_dc_offset('I', 'tx'),
+            value=state['tx_i_dc_offset'],
             step=1,
             start=-200,
             end=200,
@@ -80,7 +90,7 @@ class KalpanaWebPanel:
             name="Channel TX: I DC offset (mV) for LO suppression")
 
         tx_q_dc_offset = pn.widgets.EditableFloatSlider(
-            value=self.srv.get_dc_offset('Q', 'tx'),
+            value=state['tx_q_dc_offset'],
             step=1,
             start=-200,
             end=200,
@@ -91,7 +101,7 @@ class KalpanaWebPanel:
             name="Channel TX: Q DC offset (mV) for LO suppression")
 
         rx_i_dc_offset = pn.widgets.EditableFloatSlider(
-            value=self.srv.get_dc_offset('I', 'rx'),
+            value=state['rx_i_dc_offset'],
             step=1,
             start=-200,
             end=200,
@@ -102,7 +112,7 @@ class KalpanaWebPanel:
             name="Channel RX: I DC offset (mV) for LO suppression")
 
         rx_q_dc_offset = pn.widgets.EditableFloatSlider(
-            value=self.srv.get_dc_offset('Q', 'rx'),
+            value=state['rx_q_dc_offset'],
             step=1,
             start=-200,
             end=200,
@@ -113,7 +123,7 @@ class KalpanaWebPanel:
             name="Channel RX: Q DC offset (mV) for LO suppression")
         
         tx_phase_offset = pn.widgets.EditableFloatSlider(
-            value=self.srv.get_phase_offset('tx'),
+            value=state['tx_phase_offset'],
             step=0.1,
             start=-2.5,
             end=2.5,
@@ -124,7 +134,7 @@ class KalpanaWebPanel:
             name="Channel TX: IQ Phase offset (degrees) for sideband suppression")
         
         rx_phase_offset = pn.widgets.EditableFloatSlider(
-            value=self.srv.get_phase_offset('rx'),
+            value=state['rx_phase_offset'],
             step=0.1,
             start=-2.5,
             end=2.5,
@@ -136,9 +146,9 @@ class KalpanaWebPanel:
 
 
         
-        GPIO2 = pn.widgets.Checkbox(name="Use Internal Reference", value=self.srv.get_gpio(2))
-        GPIO3 = pn.widgets.Checkbox(name="Use Internal Reference for Low Side", value=self.srv.get_gpio(3))
-        GPIO6 = pn.widgets.Checkbox(name="Disable Input 20dB Attenuator", value=self.srv.get_gpio(6))
+        GPIO2 = pn.widgets.Checkbox(name="Use Internal Reference", value=state['gpio_val']['2'])
+        GPIO3 = pn.widgets.Checkbox(name="Use Internal Reference for Low Side", value=state['gpio_val']['3'])
+        GPIO6 = pn.widgets.Checkbox(name="Disable Input 20dB Attenuator", value=state['gpio_val']['6'])
 
         reset_lmx = pn.widgets.Button(name="Reset LMX", button_type="primary")
         
@@ -156,6 +166,31 @@ class KalpanaWebPanel:
 
         pn.bind(self.update_phase_offset, channel="tx", v=tx_phase_offset, watch=True)
         pn.bind(self.update_phase_offset, channel="rx", v=rx_phase_offset, watch=True)
+
+        # Widgets kept in step with changes pushed by the daemon, with the
+        # scale from the state's units to the widget's
+        self.widgets = {
+            'f_a_lo': ( a_LO, 1e-9 ),
+            'f_b_lo': ( b_LO, 1e-9 ),
+            'tx_i_gain': ( tx_i_gain, 1 ),
+            'rx_i_gain': ( rx_i_gain, 1 ),
+            'tx_phase_offset': ( tx_phase_offset, 1 ),
+            'rx_phase_offset': ( rx_phase_offset, 1 ),
+            'tx_i_dc_offset': ( tx_i_dc_offset, 1 ),
+            'tx_q_dc_offset': ( tx_q_dc_offset, 1 ),
+            'rx_i_dc_offset': ( rx_i_dc_offset, 1 ),
+            'rx_q_dc_offset': ( rx_q_dc_offset, 1 ),
+        }
+
+        self.gpio_widgets = { '2': GPIO2, '3': GPIO3, '6': GPIO6 }
+
+        # Set while applying pushed changes, so they are not sent back
+        self._updating = False
+
+        self.doc = pn.state.curdoc
+
+        srv.subscribe(self.on_change)
+        pn.state.on_session_destroyed(lambda ctx: srv.unsubscribe(self.on_change))
         
         component = pn.Accordion(
             ( "Frequency", pn.Column(a_LO, b_LO) ),
@@ -171,30 +206,55 @@ class KalpanaWebPanel:
             title="Kalpana", sidebar=[sidebar], main=[component], accent=ACCENT
         ).servable()
 
-    @property
-    def srv(self):
+    def on_change(self, delta):
+        # Called from the client's thread; widgets may only be touched
+        # from the session's own
+        if self.doc is None:
+            self.apply_change(delta)
+        else:
+            self.doc.add_next_tick_callback(partial(self.apply_change, delta))
+
+    def apply_change(self, delta):
+        self._updating = True
+
         try:
-            self.conn.root.keep_alive()
-        except EOFError:
-            self.conn = rpyc.connect('localhost', 37000)
-            return self.srv
+            for k, v in delta.items():
+                if k in self.widgets:
+                    widget, scale = self.widgets[k]
+                    widget.value = v * scale
+
+            for n, v in delta.get('gpio_val', {}).items():
+                if n in self.gpio_widgets:
+                    self.gpio_widgets[n].value = v
+        finally:
+            self._updating = False
 
-        return self.conn.root
-        
     def update_freq(self, lo, freq):
-            print(f"Updating frequency for {lo} to {freq}...")
+            if self._updating:
+                return
+
+            log.info(f"Updating frequency for {lo} to {freq}...")
             if lo == "a":
                 self.srv.set_a_LO(freq * 1e9)
             elif lo == "b":
                 self.srv.set_b_LO(freq * 1e9)
         
     def update_i_gain(self, channel, v):
+        if self._updating:
+            return
+
         self.srv.set_i_gain(channel, v)
 
     def update_dc_offset(self, iq, channel, v):
+        if self._updating:
+            return
+
         self.srv.set_dc_offset(iq, channel, v)
         
     def update_phase_offset(self, channel, v):
+        if self._updating:
+            return
+
         self.srv.set_phase_offset(channel, v)
     
     def reset_lmx(self):
@@ -202,5 +262,7 @@ class KalpanaWebPanel:
 
         
 if __name__ == '__main__':
-    p = KalpanaWebPanel()
-    pn.serve(p.t, show=False, port=5006, static_dirs={'assets': f'{Path(__file__).parent/"assets"}'})
+    kalpana_log.setup()
+
+    client = KalpanaClient()
+    pn.serve(lambda: KalpanaWebPanel(client).t, show=False, port=5006, static_dirs={'assets': f'{Path(__file__).parent/"assets"}'})
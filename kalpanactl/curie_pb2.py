@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# NO CHECKED-IN PROTOBUF GENCODE
+# source: kalpanactl/curie.proto
+# Protobuf Python Version: 7.35.1
+"""Generated protocol buffer code."""
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import runtime_version as _runtime_version
+from google.protobuf import symbol_database as _symbol_database
+from google.protobuf.internal import builder as _builder
+_runtime_version.ValidateProtobufRuntimeVersion(
+    _runtime_version.Domain.PUBLIC,
+    7,
+    35,
+    1,
+    '',
+    'kalpanactl/curie.proto'
+)
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x16kalpanactl/curie.proto\"=\n\x0eSetGainRequest\x12\x0c\n\x04isTX\x18\x01 \x01(\x08\x12\x0f\n\x07\x63hannel\x18\x02 \x01(\x05\x12\x0c\n\x04gain\x18\x03 \x01(\x02\"/\n\x0eGetGainRequest\x12\x0c\n\x04isTX\x18\x01 \x01(\x08\x12\x0f\n\x07\x63hannel\x18\x02 \x01(\x05\"9\n\nGainStatus\x12\x0c\n\x04isTX\x18\x01 \x01(\x08\x12\x0f\n\x07\x63hannel\x18\x02 \x01(\x05\x12\x0c\n\x04gain\x18\x03 \x01(\x02\".\n\x0cSetGainBatch\x12\x1e\n\x05gains\x18\x01 \x03(\x0b\x32\x0f.SetGainRequest\"-\n\x0fGainStatusBatch\x12\x1a\n\x05gains\x18\x01 \x03(\x0b\x32\x0b.GainStatus2\x90\x01\n\x05\x43urie\x12)\n\x07SetGain\x12\x0f.SetGainRequest\x1a\x0b.GainStatus\"\x00\x12)\n\x07GetGain\x12\x0f.GetGainRequest\x1a\x0b.GainStatus\"\x00\x12\x31\n\x08SetGains\x12\r.SetGainBatch\x1a\x10.GainStatusBatch\"\x00(\x01\x30\x01\x62\x06proto3')
+
+_globals = globals()
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'kalpanactl.curie_pb2', _globals)
+if not _descriptor._USE_C_DESCRIPTORS:
+  DESCRIPTOR._loaded_options = None
+  _globals['_SETGAINREQUEST']._serialized_start=26
+  _globals['_SETGAINREQUEST']._serialized_end=87
+  _globals['_GETGAINREQUEST']._serialized_start=89
+  _globals['_GETGAINREQUEST']._serialized_end=136
+  _globals['_GAINSTATUS']._serialized_start=138
+  _globals['_GAINSTATUS']._serialized_end=195
+  _globals['_SETGAINBATCH']._serialized_start=197
+  _globals['_SETGAINBATCH']._serialized_end=243
+  _globals['_GAINSTATUSBATCH']._serialized_start=245
+  _globals['_GAINSTATUSBATCH']._serialized_end=290
+  _globals['_CURIE']._serialized_start=293
+  _globals['_CURIE']._serialized_end=437
+# @@protoc_insertion_point(module_scope)
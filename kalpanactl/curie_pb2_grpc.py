@@ -0,0 +1,185 @@
+# Generated by the gRPC Python protocol compiler plugin. DO NOT EDIT!
+"""Client and server classes corresponding to protobuf-defined services."""
+import grpc
+import warnings
+
+from kalpanactl import curie_pb2 as kalpanactl_dot_curie__pb2
+
+GRPC_GENERATED_VERSION = '1.84.0'
+GRPC_VERSION = grpc.__version__
+_version_not_supported = False
+
+try:
+    from grpc._utilities import first_version_is_lower
+    _version_not_supported = first_version_is_lower(GRPC_VERSION, GRPC_GENERATED_VERSION)
+except ImportError:
+    _version_not_supported = True
+
+if _version_not_supported:
+    raise RuntimeError(
+        f'The grpc package installed is at version {GRPC_VERSION},'
+        + ' but the generated code in kalpanactl/curie_pb2_grpc.py depends on'
+        + f' grpcio>={GRPC_GENERATED_VERSION}.'
+        + f' Please upgrade your grpc module to grpcio>={GRPC_GENERATED_VERSION}'
+        + f' or downgrade your generated code using grpcio-tools<={GRPC_VERSION}.'
+    )
+
+
+class CurieStub:
+    """Missing associated documentation comment in .proto file."""
+
+    def __init__(self, channel):
+        """Constructor.
+
+        Args:
+            channel: A grpc.Channel.
+        """
+        self.SetGain = channel.unary_unary(
+                '/Curie/SetGain',
+                request_serializer=kalpanactl_dot_curie__pb2.SetGainRequest.SerializeToString,
+                response_deserializer=kalpanactl_dot_curie__pb2.GainStatus.FromString,
+                _registered_method=True)
+        self.GetGain = channel.unary_unary(
+                '/Curie/GetGain',
+                request_serializer=kalpanactl_dot_curie__pb2.GetGainRequest.SerializeToString,
+                response_deserializer=kalpanactl_dot_curie__pb2.GainStatus.FromString,
+                _registered_method=True)
+        self.SetGains = channel.stream_stream(
+                '/Curie/SetGains',
+                request_serializer=kalpanactl_dot_curie__pb2.SetGainBatch.SerializeToString,
+                response_deserializer=kalpanactl_dot_curie__pb2.GainStatusBatch.FromString,
+                _registered_method=True)
+
+
+class CurieServicer:
+    """Missing associated documentation comment in .proto file."""
+
+    def SetGain(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetGain(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def SetGains(self, request_iterator, context):
+        """Each batch is applied as one simultaneous DAC update and answered
+        with the resulting gains, in order, on the same stream
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+
+def add_CurieServicer_to_server(servicer, server):
+    rpc_method_handlers = {
+            'SetGain': grpc.unary_unary_rpc_method_handler(
+                    servicer.SetGain,
+                    request_deserializer=kalpanactl_dot_curie__pb2.SetGainRequest.FromString,
+                    response_serializer=kalpanactl_dot_curie__pb2.GainStatus.SerializeToString,
+            ),
+            'GetGain': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetGain,
+                    request_deserializer=kalpanactl_dot_curie__pb2.GetGainRequest.FromString,
+                    response_serializer=kalpanactl_dot_curie__pb2.GainStatus.SerializeToString,
+            ),
+            'SetGains': grpc.stream_stream_rpc_method_handler(
+                    servicer.SetGains,
+                    request_deserializer=kalpanactl_dot_curie__pb2.SetGainBatch.FromString,
+                    response_serializer=kalpanactl_dot_curie__pb2.GainStatusBatch.SerializeToString,
+            ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler(
+            'Curie', rpc_method_handlers)
+    server.add_generic_rpc_handlers((generic_handler,))
+    server.add_registered_method_handlers('Curie', rpc_method_handlers)
+
+
+ # This class is part of an EXPERIMENTAL API.
+class Curie:
+    """Missing associated documentation comment in .proto file."""
+
+    @staticmethod
+    def SetGain(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/Curie/SetGain',
+            kalpanactl_dot_curie__pb2.SetGainRequest.SerializeToString,
+            kalpanactl_dot_curie__pb2.GainStatus.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetGain(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/Curie/GetGain',
+            kalpanactl_dot_curie__pb2.GetGainRequest.SerializeToString,
+            kalpanactl_dot_curie__pb2.GainStatus.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def SetGains(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(
+            request_iterator,
+            target,
+            '/Curie/SetGains',
+            kalpanactl_dot_curie__pb2.SetGainBatch.SerializeToString,
+            kalpanactl_dot_curie__pb2.GainStatusBatch.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
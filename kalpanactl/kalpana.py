@@ -1,18 +1,27 @@
+import logging
+import os
+import queue
 import time
+import threading
 
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
+from types import MappingProxyType
 from pathlib import Path
 from json import JSONDecodeError
 
-from periphery import SPI, GPIO
-
 from marshmallow import Schema, fields, post_load
 
+from .backend import get_backend
 from .lmx2820 import LMX2820
-#from .ltc2668 import LTC2668
+from .ltc2668 import LTC2668
 from .ltc5594 import LTC5594
+from .persist import ConfigPersister
+from .calibration import CalibrationTable
 #from .adrf6520 import ADRF6520
-#from .channel_gain import ADRFGainTable
+from .channel_gain import ADRFGainTable
+from .trace import span, traced
+
+log = logging.getLogger(__name__)
 
 
 @dataclass
@@ -32,23 +41,78 @@ class KalpanaConfig:
     tx_q_dc_offset : float = 0
     rx_i_dc_offset : float = 0
     rx_q_dc_offset : float = 0
+
+    # ADRF6520 gain in dB per channel, and the spidev node of the
+    # LTC2668 driving their gain control inputs.  Gains cannot be set
+    # without it.
+    gain : dict = field(default_factory=lambda: { c: 0.0 for c in ADRFGainTable.CHANNELS })
+    gain_dac : str = None
+
+    # LTC2668 output driving each ADRF6520's VGN1/VGN2.  Not yet
+    # checked against the schematic.
+    gain_channels : dict = field(default_factory=lambda: { 'rx0': 0, 'rx1': 1, 'tx0': 2, 'tx1': 3 })
+
+    # gain,voltage CSV from ADRF6520GainCurve/combine.py to use instead
+    # of the built-in ADRF6520 curve
+    gain_table : str = None
+
+    # Per-LO-frequency IQ/DC corrections, see CalibrationTable
+    tx_cal : list = field(default_factory=list)
+    rx_cal : list = field(default_factory=list)
+
+    # LO frequencies to plan ahead of time at startup
+    lo_preload : list = field(default_factory=list)
+
+    # Seconds to let the internal reference settle after switching to
+    # it, and to wait for the LMXs to report lock
+    ref_settle : float = 0.01
+    lock_timeout : float = 0.01
+
+    # Start by reading back the devices and only writing what differs
+    # from the configuration, instead of programming from scratch
+    fast_start : bool = True
+
+    # Where the devices are, see backend.py.  KALPANA_BACKEND overrides it.
+    backend : str = "periphery"
    
-class KalpanaConfigSchema(Schema):
+class KalpanaStateSchema(Schema):
+    # The settings clients can read and change at runtime, see
+    # Kalpana.get_state() and Kalpana.apply_state()
     f_b_lo = fields.Float()
     f_a_lo = fields.Float()
     gpio_val = fields.Dict(fields.Int(), fields.Bool())
 
     # IQ Corrections for Sideband Suppression
-    tx_i_gain : fields.Float()
-    rx_i_gain : fields.Float()
-    tx_phase_offset : fields.Float()
-    rx_phase_offset : fields.Float()
+    tx_i_gain = fields.Float()
+    rx_i_gain = fields.Float()
+    tx_phase_offset = fields.Float()
+    rx_phase_offset = fields.Float()
 
     # DC Offsets for LO Suppression
-    tx_i_dc_offset : fields.Float()
-    tx_q_dc_offset : fields.Float()
-    rx_i_dc_offset : fields.Float()
-    rx_q_dc_offset : fields.Float()
+    tx_i_dc_offset = fields.Float()
+    tx_q_dc_offset = fields.Float()
+    rx_i_dc_offset = fields.Float()
+    rx_q_dc_offset = fields.Float()
+
+    gain = fields.Dict(fields.Str(), fields.Float())
+
+
+class KalpanaConfigSchema(KalpanaStateSchema):
+    gain_dac = fields.Str(allow_none=True)
+    gain_channels = fields.Dict(fields.Str(), fields.Int())
+    gain_table = fields.Str(allow_none=True)
+
+    tx_cal = fields.List(fields.List(fields.Float()))
+    rx_cal = fields.List(fields.List(fields.Float()))
+
+    lo_preload = fields.List(fields.Float())
+
+    ref_settle = fields.Float()
+    lock_timeout = fields.Float()
+
+    fast_start = fields.Bool()
+
+    backend = fields.Str()
 
     @post_load
     def make_config(self, data, **kwargs):
@@ -57,22 +121,46 @@ class KalpanaConfigSchema(Schema):
 
 class Kalpana:
    
-    def __init__(self):
+    CONFIG_PATH = Path(os.environ.get("KALPANA_CONF", "/etc/kalpana.conf"))
+
+    def __init__(self, backend=None):
+        self._persister = ConfigPersister(
+            self.CONFIG_PATH,
+            lambda: KalpanaConfigSchema().dumps(self._state))
+
+        self._publish_lock = threading.Lock()
+
+        # Callbacks told about every change, see subscribe()
+        self._subscribers = []
+        self._changes = queue.SimpleQueue()
+
+        threading.Thread(target=self._notify, name="kalpana-notify", daemon=True).start()
+
         self.load_config()
 
-        print(self._config)
+        log.debug(self._config)
+
+        self._cal = {
+            'tx': CalibrationTable(self._config.tx_cal),
+            'rx': CalibrationTable(self._config.rx_cal),
+        }
         
+        self.backend = get_backend(backend, self._config.backend)
+
+        warm = self._config.fast_start
+
+        # Open the lines at their configured level so a restart does
+        # not glitch the reference or attenuator selection
         self.GPIO = {
-            2: GPIO("/dev/gpiochip0", 2, "out"),
-            3: GPIO("/dev/gpiochip0", 3, "out"),
-            6: GPIO("/dev/gpiochip0", 6, "out"),
+            n: self.backend.gpio("/dev/gpiochip0", n, "high" if self._config.gpio_val[n] else "low")
+            for n in [ 2, 3, 6 ]
         }
         
         # SPI 1.0 is the TX-side LTC5594
         # SPI 1.1 is thee RX-side LTC5594
         self.ltc5594 = [
-            LTC5594(SPI("/dev/spidev1.0", 0, 1000000)),
-            LTC5594(SPI("/dev/spidev1.1", 0, 1000000))
+            LTC5594(self.backend.spi("/dev/spidev1.0", "ltc5594"), warm=warm),
+            LTC5594(self.backend.spi("/dev/spidev1.1", "ltc5594"), warm=warm)
         ]
 
         self.ltc5594[0].set_freq(self._config.f_a_lo)
@@ -93,110 +181,402 @@ class Kalpana:
         self.ltc5594[1].set_dc_offset("I", self._config.rx_i_dc_offset)
         self.ltc5594[1].set_dc_offset("Q", self._config.rx_q_dc_offset)
         self.ltc5594[1].program()
+
+        if self._config.gain_table:
+            self.gain_table = ADRFGainTable.from_csv(self._config.gain_table)
+        else:
+            self.gain_table = ADRFGainTable()
+
+        # The DAC cannot be read back, so it is always programmed.
+        # Rewriting the same span and code leaves the outputs alone.
+        self.dac = None
+
+        if self._config.gain_dac:
+            self.dac = LTC2668(self.backend.spi(self._config.gain_dac, "ltc2668"))
+            self._write_gains(self._config.gain)
        
-        self.LO_B = LMX2820(SPI("/dev/spidev1.3", 0, 1000000), f_outa=2e9, pwra=3)
-        self.LO_A = LMX2820(SPI("/dev/spidev1.2", 0, 1000000), f_outa=1e9, pwra=3)
-
-        # Program GPIOs to use internal reference first
-        # to make sure LMX has a ref clock
-        self.set_gpio(2, True)
-        self.set_gpio(3, True)
-        self.set_gpio(6, self._config.gpio_val[6])
-        
-        self.LO_B.set_fout(self._config.f_b_lo)
-        self.LO_B.program()
+        self.LO_B = LMX2820(self.backend.spi("/dev/spidev1.3", "lmx2820"), f_outa=2e9, pwra=3)
+        self.LO_A = LMX2820(self.backend.spi("/dev/spidev1.2", "lmx2820"), f_outa=1e9, pwra=3)
+
+        self.LO_A.preload(self._config.lo_preload)
+        self.LO_B.preload(self._config.lo_preload)
 
+        self.LO_B.set_fout(self._config.f_b_lo)
         self.LO_A.set_fout(self._config.f_a_lo)
-        self.LO_A.program()
 
-        self.set_gpio(2, self._config.gpio_val[2])
-        self.set_gpio(3, self._config.gpio_val[3])
+        los = [ self.LO_B, self.LO_A ]
+
+        if warm:
+            for LO in los:
+                LO.warm_start()
+
+            los = [ LO for LO in los if not LO.in_sync ]
+
+        if los:
+            log.info(f"Programming {len(los)} LMX(s)")
+
+            # Switch to the internal reference first to make sure
+            # the LMXs have a ref clock
+            self.use_internal_ref()
+
+            try:
+                for LO in los:
+                    LO.program()
+
+                for LO in los:
+                    LO.wait_lock(self._config.lock_timeout)
+            except TimeoutError as e:
+                log.error(f"{e}")
+            finally:
+                self.restore_ref()
 
     def load_config(self):
-        if not Path("/etc/kalpana.conf").exists():
-            with open("/etc/kalpana.conf", "w") as f:
-                print("Creating new configuration")
-                f.write(KalpanaConfigSchema().dumps(KalpanaConfig()))
+        if not self.CONFIG_PATH.exists():
+            # Saved in the background, so a config directory the daemon
+            # cannot write to does not keep it from starting
+            log.info("Creating new configuration")
+            self._config = KalpanaConfig()
+            self._commit()
+            return
 
         try:
-            with open("/etc/kalpana.conf", "r") as f:
+            with open(self.CONFIG_PATH, "r") as f:
                 self._config = KalpanaConfigSchema().loads(f.read())
         except JSONDecodeError:
             self._config = KalpanaConfig()
-            self.save_config()
+            self._commit()
+        else:
+            self.publish()
             
                 
     def save_config(self):
-        with open("/etc/kalpana.conf", "w") as f:
-            f.write(KalpanaConfigSchema().dumps(self._config))
+        # Written out in the background, see ConfigPersister
+        self._persister.schedule()
+
+    def flush_config(self):
+        return self._persister.flush()
+
+    def get_config_error(self):
+        # Why the configuration could not be saved, None if it could
+        return self._persister.error
+
+    def publish(self):
+        # Getters read from this copy of the configuration.  It is
+        # swapped in whole and never modified afterwards, so readers
+        # need no locking and never see a half-applied change.
+        with self._publish_lock:
+            old = getattr(self, '_state', None)
+
+            self._state = replace(self._config,
+                                  gpio_val=MappingProxyType(dict(self._config.gpio_val)),
+                                  gain=MappingProxyType(dict(self._config.gain)),
+                                  lo_preload=tuple(self._config.lo_preload))
+
+            if old is not None and self._subscribers:
+                self._changes.put((old, self._state))
+
+    def subscribe(self, callback):
+        # callback(delta) is called from a background thread after every
+        # change, with only what changed in get_state() form, e.g.
+        # { 'f_a_lo': 2.4e9, 'gain': { 'rx0': 10.0 } }.  It should not
+        # block for long, every subscriber waits on it.
+        with self._publish_lock:
+            self._subscribers = self._subscribers + [ callback ]
+
+    def unsubscribe(self, callback):
+        with self._publish_lock:
+            self._subscribers = [ s for s in self._subscribers if s != callback ]
+
+    @staticmethod
+    def state_delta(old, new):
+        delta = {}
+
+        for k, v in new.items():
+            if isinstance(v, dict):
+                changed = { n: x for n, x in v.items() if old[k].get(n) != x }
+
+                if changed:
+                    delta[k] = changed
+            elif v != old[k]:
+                delta[k] = v
+
+        return delta
+
+    def _notify(self):
+        # Works out the deltas and calls the subscribers off the hardware
+        # path, so a slow client never holds up the scheduler
+        schema = KalpanaStateSchema()
+
+        while True:
+            old, new = self._changes.get()
+
+            delta = self.state_delta(schema.dump(old), schema.dump(new))
+
+            if not delta:
+                continue
+
+            for callback in self._subscribers:
+                try:
+                    callback(delta)
+                except Exception as e:
+                    log.warning(f"Failed to notify {callback}: {e!r}")
+
+    @traced("Kalpana.commit")
+    def _commit(self, persist=True):
+        self.publish()
+
+        if persist:
+            self.save_config()
         
 
 
     def get_a_LO(self):
-        return self._config.f_a_lo
+        return self._state.f_a_lo
         
 
     def get_b_LO(self):
-        return self._config.f_b_lo
+        return self._state.f_b_lo
 
     def get_i_gain(self, channel):
         assert channel in ['tx', 'rx']
 
         if channel == 'tx':
-            return self._config.tx_i_gain
+            return self._state.tx_i_gain
         else:
-            return self._config.rx_i_gain
+            return self._state.rx_i_gain
 
     
-    def set_b_LO(self, f):
-        assert f >= 400e6 and f <= 4.4e9
-        print(f"Setting the B LO to {f}")
+    @traced("Kalpana.use_internal_ref")
+    def use_internal_ref(self):
+        # Make sure the LMXs have a reference clock while they
+        # calibrate.  Only wait for it to settle if we actually
+        # switched away from the external reference.
+        switched = not (self._config.gpio_val[2] and self._config.gpio_val[3])
 
         self.GPIO[2].write(True)
         self.GPIO[3].write(True)
-        time.sleep(0.01)
 
-        self.LO_B.set_fout(f)
-        self.LO_B.program()
-        self._config.f_b_lo = f
+        if switched:
+            with span("ref_settle"):
+                time.sleep(self._config.ref_settle)
 
-        time.sleep(0.01)        
+    @traced("Kalpana.restore_ref")
+    def restore_ref(self):
         self.GPIO[2].write(self._config.gpio_val[2])
         self.GPIO[3].write(self._config.gpio_val[3])
 
-        print(f"Telling the RX 5594 to configure for {f}")
-        self.ltc5594[1].set_freq(self._config.f_b_lo)
-        self.ltc5594[1].program()
-        
-        self.save_config()
+    @traced("Kalpana.retune")
+    def _retune(self, a=None, b=None):
+        # Retune either or both LOs with a single reference switch.
+        # Both LMXs calibrate at the same time, so retuning the pair
+        # costs about the same as retuning one.  The LTC5594s are set
+        # up for the new frequencies but left for the caller to program.
+        los = []
+
+        for f in (a, b):
+            if f is not None:
+                self.check_lo(f)
+
+        if a is not None:
+            log.info(f"Setting the A LO to {a}")
+            los.append(('a', 'tx', self.LO_A, self.ltc5594[0], a))
+
+        if b is not None:
+            log.info(f"Setting the B LO to {b}")
+            los.append(('b', 'rx', self.LO_B, self.ltc5594[1], b))
+
+        self.use_internal_ref()
+
+        lock_time = {}
+        failed = {}
+
+        try:
+            for lo, channel, LO, ltc, f in los:
+                LO.set_fout(f)
+                LO.program()
+
+            for lo, channel, LO, ltc, f in los:
+                try:
+                    lock_time[lo] = LO.wait_lock(self._config.lock_timeout)
+                except TimeoutError as e:
+                    log.error(f"{lo.upper()} LO: {e}")
+                    failed[lo] = e
+        finally:
+            self.restore_ref()
+
+        # Only a locked LO makes it into the configuration, but one
+        # failing to lock doesn't keep the other out of it
+        for lo, channel, LO, ltc, f in los:
+            if lo in failed:
+                continue
+
+            setattr(self._config, f"f_{lo}_lo", f)
+
+            log.info(f"{lo.upper()} LO locked in {lock_time[lo] * 1e6:.0f}us")
+            log.debug(f"Telling the {channel.upper()} 5594 to configure for {f}")
+            ltc.set_freq(f)
+            self.apply_calibration(channel, f)
+
+        return lock_time, failed
+
+    @staticmethod
+    def _lock_failure(failed):
+        return TimeoutError("; ".join(f"{lo.upper()} LO: {e}" for lo, e in failed.items()))
+
+    @traced("Kalpana.set_LOs")
+    def set_LOs(self, a=None, b=None):
+        lock_time, failed = self._retune(a, b)
+
+        if lock_time:
+            for ltc in self.ltc5594:
+                ltc.program()
+
+            self._commit()
 
+        if failed:
+            raise self._lock_failure(failed)
+
+        return lock_time.get('a'), lock_time.get('b')
+
+    def set_b_LO(self, f):
+        return self.set_LOs(b=f)[1]
         
     def set_a_LO(self, f):
-        assert f >= 400e6 and f <= 4.4e9
-        print(f"Setting the A LO to {f}")
+        return self.set_LOs(a=f)[0]
 
-        self.GPIO[2].write(True)
-        self.GPIO[3].write(True)
-        time.sleep(0.01)
+    @traced("Kalpana.set_hop_list")
+    def set_hop_list(self, lo, freqs):
+        assert lo in [ 'a', 'b' ]
 
-        self.LO_A.set_fout(f)
-        self.LO_A.program()
-        self._config.f_a_lo = f
+        for f in freqs:
+            self.check_lo(f)
 
-        time.sleep(0.01)        
-        self.GPIO[2].write(self._config.gpio_val[2])
-        self.GPIO[3].write(self._config.gpio_val[3])
+        LO = self.LO_A if lo == 'a' else self.LO_B
 
-        print(f"Telling the TX 5594 to configure for {f}")
-        self.ltc5594[0].set_freq(self._config.f_a_lo)
-        self.ltc5594[0].program()
+        log.info(f"Calibrating {lo.upper()} LO hops {freqs}")
+
+        self.use_internal_ref()
+
+        try:
+            hops = LO.calibrate_hops(freqs, self._config.lock_timeout)
+        finally:
+            self.restore_ref()
+
+        return hops
+
+    def get_hop_list(self, lo):
+        assert lo in [ 'a', 'b' ]
+
+        return (self.LO_A if lo == 'a' else self.LO_B).hops
+
+    @traced("Kalpana.hop")
+    def hop(self, lo, n):
+        assert lo in [ 'a', 'b' ]
+
+        # Hops stay on the current reference and skip the settle
+        # delays, the configuration is not written back either
+        if lo == 'a':
+            f = self.LO_A.hop(n)
+            self._config.f_a_lo = f
+            channel, ltc = 'tx', self.ltc5594[0]
+        else:
+            f = self.LO_B.hop(n)
+            self._config.f_b_lo = f
+            channel, ltc = 'rx', self.ltc5594[1]
+
+        ltc.set_freq(f)
+        self.apply_calibration(channel, f)
+        ltc.program()
+
+        self._commit(persist=False)
+
+        return f
+
+    @traced("Kalpana.apply_calibration")
+    def apply_calibration(self, channel, f):
+        # Load the corrections for this LO frequency into the LTC5594
+        # without programming it, so they go out together with the
+        # band change
+        table = self._cal[channel]
+
+        if not len(table):
+            return
+
+        i_gain, phase_offset, i_dc_offset, q_dc_offset = table.lookup(f)
+
+        ltc = self.ltc5594[0 if channel == 'tx' else 1]
+
+        ltc.set_i_gain(i_gain)
+        ltc.set_phase_offset(phase_offset)
+        ltc.set_dc_offset("I", i_dc_offset)
+        ltc.set_dc_offset("Q", q_dc_offset)
 
-        self.save_config()
+        setattr(self._config, f"{channel}_i_gain", i_gain)
+        setattr(self._config, f"{channel}_phase_offset", phase_offset)
+        setattr(self._config, f"{channel}_i_dc_offset", i_dc_offset)
+        setattr(self._config, f"{channel}_q_dc_offset", q_dc_offset)
+
+    def store_calibration(self, channel):
+        # Record the current corrections as the calibration for the
+        # current LO frequency of that channel
+        assert channel in [ 'tx', 'rx' ]
+
+        c = self._config
+        f = c.f_a_lo if channel == 'tx' else c.f_b_lo
+
+        table = self._cal[channel]
+        table.insert(f,
+                     getattr(c, f"{channel}_i_gain"),
+                     getattr(c, f"{channel}_phase_offset"),
+                     getattr(c, f"{channel}_i_dc_offset"),
+                     getattr(c, f"{channel}_q_dc_offset"))
+
+        setattr(c, f"{channel}_cal", table.rows())
+        self._commit()
+
+    def clear_calibration(self, channel):
+        assert channel in [ 'tx', 'rx' ]
+
+        self._cal[channel].clear()
+        setattr(self._config, f"{channel}_cal", [])
+        self._commit()
+
+    def get_calibration(self, channel):
+        assert channel in [ 'tx', 'rx' ]
+
+        return getattr(self._state, f"{channel}_cal")
+
+    # Checks for the setters below, for callers that validate ahead of
+    # queueing a setting, see kalpanactld
+    def check_lo(self, f):
+        assert f >= 400e6 and f <= 4.4e9, f"LO frequency ({f}) must be between 400MHz and 4.4GHz"
+
+    def check_i_gain(self, channel, gain):
+        assert channel in [ 'tx', 'rx' ], f"Invalid channel {channel}"
+        assert gain >= -0.5 and gain <= 0.5, f"I gain ({gain}) must be between -0.5 and 0.5"
+
+    def check_phase_offset(self, channel, offset):
+        assert channel in [ 'tx', 'rx' ], f"Invalid channel {channel}"
+        assert offset >= -2.5 and offset <= 2.5, f"Phase offset ({offset}) must be between -2.5 and 2.5"
+
+    def check_dc_offset(self, iq, channel, offset):
+        assert iq in [ 'I', 'Q' ], f"Invalid component {iq}"
+        assert channel in [ 'tx', 'rx' ], f"Invalid channel {channel}"
+        assert offset >= -200 and offset <= 200, f"DC offset ({offset}) must be between -200 and 200"
+
+    def check_gains(self, gains):
+        assert not gains or self._config.gain_dac, "No gain DAC configured, see gain_dac"
+
+        lo, hi = self.gain_table.gain_range
+
+        for c, gain in gains.items():
+            assert c in self._config.gain_channels, f"Invalid channel {c}"
+            assert gain >= lo and gain <= hi, f"Gain ({gain}) must be between {lo} and {hi}"
 
     # IQ Corrections for Sideband Suppression    
+    @traced("Kalpana.set_i_gain")
     def set_i_gain(self, channel, gain):
-        assert channel in [ 'tx', 'rx' ]
-        assert gain >= -0.5 and gain <= 0.5
+        self.check_i_gain(channel, gain)
 
         if channel == 'tx':
             ltc = self.ltc5594[0]
@@ -208,10 +588,12 @@ class Kalpana:
         ltc.set_i_gain(gain)
         ltc.program()
 
+        self._commit()
+
     # IQ Corrections for Sideband Suppression
+    @traced("Kalpana.set_phase_offset")
     def set_phase_offset(self, channel, offset):
-        assert channel in [ 'tx', 'rx' ]
-        assert offset >= -2.5 and offset <= 2.5
+        self.check_phase_offset(channel, offset)
 
         if channel == 'tx':
             ltc = self.ltc5594[0]
@@ -223,18 +605,19 @@ class Kalpana:
         ltc.set_phase_offset(offset)
         ltc.program()
 
+        self._commit()
+
     def get_phase_offset(self, channel):
         assert channel in ['tx', 'rx']
         if channel == 'tx':
-            return self._config.tx_phase_offset
+            return self._state.tx_phase_offset
         else:
-            return self._config.rx_phase_offset
+            return self._state.rx_phase_offset
 
     # DC Offsets for LO Suppression
+    @traced("Kalpana.set_dc_offset")
     def set_dc_offset(self, iq, channel, offset):
-        assert iq in [ 'I', 'Q' ]
-        assert channel in [ 'tx', 'rx' ]
-        assert offset >= -200 and offset <= 200
+        self.check_dc_offset(iq, channel, offset)
 
         if channel == 'tx':
             ltc = self.ltc5594[0]
@@ -253,25 +636,136 @@ class Kalpana:
             
         ltc.program()
 
+        self._commit()
+
     def get_dc_offset(self, iq, channel):
         assert iq in ['I', 'Q']
         assert channel in ['tx', 'rx']
 
         if iq == 'I' and channel == 'tx':
-            return self._config.tx_i_dc_offset
+            return self._state.tx_i_dc_offset
         elif iq == 'I' and channel == 'rx':
-            return self._config.rx_i_dc_offset
+            return self._state.rx_i_dc_offset
         elif iq == 'Q' and channel == 'tx':
-            return self._config.tx_q_dc_offset
+            return self._state.tx_q_dc_offset
         else:
-            return self._config.rx_q_dc_offset
+            return self._state.rx_q_dc_offset
      
+    # ADRF6520 gain
+    def _gain_voltages(self, gains):
+        voltages = self.gain_table.channel_voltages(dict(gains))
+
+        return { self._config.gain_channels[c]: v for c, v in voltages.items() }
+
+    def _write_gains(self, gains):
+        self.dac.setVs(self._gain_voltages(gains))
+
+    @traced("Kalpana.set_gains")
+    def set_gains(self, gains):
+        # Takes { channel: gain in dB }, e.g. { 'rx0': 20, 'tx1': 10.5 }.
+        # All of them change at the same instant.
+        self.check_gains(gains)
+
+        self._write_gains(gains)
+
+        self._config.gain.update(gains)
+        self._commit()
+
+    def set_gain(self, channel, gain):
+        self.set_gains({ channel: gain })
+
+    def get_gain(self, channel):
+        try:
+            return self._state.gain[channel]
+        except KeyError:
+            raise Exception(f"Invalid channel {channel}")
+
+    def get_state(self):
+        # Every runtime setting in one dict, see KalpanaStateSchema
+        return KalpanaStateSchema().dump(self._state)
+
+    @traced("Kalpana.apply_state")
+    def apply_state(self, state):
+        # Takes any subset of get_state().  Everything is checked before
+        # the hardware is touched, then the LOs are retuned with a single
+        # reference switch, each LTC5594 and the DAC are programmed once
+        # and the configuration is committed once.
+        state = KalpanaStateSchema().load(state, partial=True)
+
+        a = state.get('f_a_lo')
+        b = state.get('f_b_lo')
+        gpio_val = state.get('gpio_val', {})
+        gains = state.get('gain', {})
+
+        for f in (a, b):
+            if f is not None:
+                self.check_lo(f)
+
+        for n in gpio_val:
+            assert n in self.GPIO, f"Invalid GPIO {n}"
+
+        for channel in [ 'tx', 'rx' ]:
+            if f"{channel}_i_gain" in state:
+                self.check_i_gain(channel, state[f"{channel}_i_gain"])
+
+            if f"{channel}_phase_offset" in state:
+                self.check_phase_offset(channel, state[f"{channel}_phase_offset"])
+
+            for iq in [ 'I', 'Q' ]:
+                if f"{channel}_{iq.lower()}_dc_offset" in state:
+                    self.check_dc_offset(iq, channel, state[f"{channel}_{iq.lower()}_dc_offset"])
+
+        self.check_gains(gains)
+
+        # GPIOs first, so a retune restores the new reference selection
+        for n, v in gpio_val.items():
+            self.GPIO[n].write(v)
+            self._config.gpio_val[n] = v
+
+        failed = {}
+
+        if a is not None or b is not None:
+            lock_time, failed = self._retune(a, b)
+
+        # Explicit corrections win over the calibration loaded by the retune
+        for channel, ltc in zip([ 'tx', 'rx' ], self.ltc5594):
+            if f"{channel}_i_gain" in state:
+                ltc.set_i_gain(state[f"{channel}_i_gain"])
+
+            if f"{channel}_phase_offset" in state:
+                ltc.set_phase_offset(state[f"{channel}_phase_offset"])
+
+            if f"{channel}_i_dc_offset" in state:
+                ltc.set_dc_offset("I", state[f"{channel}_i_dc_offset"])
+
+            if f"{channel}_q_dc_offset" in state:
+                ltc.set_dc_offset("Q", state[f"{channel}_q_dc_offset"])
+
+            for key in [ 'i_gain', 'phase_offset', 'i_dc_offset', 'q_dc_offset' ]:
+                if f"{channel}_{key}" in state:
+                    setattr(self._config, f"{channel}_{key}", state[f"{channel}_{key}"])
+
+            ltc.program()
+
+        if gains:
+            self._write_gains(gains)
+            self._config.gain.update(gains)
+
+        self._commit()
+
+        # Everything else is applied, but the caller has to know
+        if failed:
+            raise self._lock_failure(failed)
+
+        return self.get_state()
+
     def get_gpio(self, channel):
         try:
-            return self._config.gpio_val[channel]
+            return self._state.gpio_val[channel]
         except KeyError:
             raise Exception(f"Invalid channel {channel}")
 
+    @traced("Kalpana.set_gpio")
     def set_gpio(self, channel, v):
         try:
             gpio = self.GPIO[channel]
@@ -281,7 +775,7 @@ class Kalpana:
         v = True if v else False
         gpio.write(v)
         self._config.gpio_val[channel] = v
-        self.save_config()
+        self._commit()
 
     def reset_lmx(self):
         self.LO_A.reset()
@@ -1,23 +1,102 @@
 #!/usr/bin/env python3
 import click
+import functools
+import grpc
+import logging
 import rpyc
 import os
+import queue
+import signal
 import sys
 import time
 import threading
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from json import JSONEncoder
+from json import JSONEncoder, loads
 
 sys.path.insert(0, "../")
-print(f"Path: {sys.path}")
 from kalpanactl import Kalpana
-from flask import Flask, request
+from kalpanactl import log as kalpana_log
+from kalpanactl import metrics
+from kalpanactl.trace import tracer
+from kalpanactl.scheduler import HardwareScheduler
+from kalpanactl import curie_pb2, curie_pb2_grpc
+from flask import Flask, Response, g, request
+
+log = logging.getLogger("kalpanactld")
+
+# All hardware access goes through the scheduler; getters are served
+# straight from Kalpana's published state
+DEVICES = ( 'gpio', 'lo_a', 'lo_b', 'ltc_tx', 'ltc_rx', 'dac' )
+
+# Opened by setup(), once logging is in place
+kalpana = None
+hw = None
+
+
+def setup(backend=None):
+    global kalpana, hw
+
+    kalpana = Kalpana(backend)
+    hw = HardwareScheduler(DEVICES)
+
+LO_DEVICES = {
+    'a': ( 'gpio', 'lo_a', 'ltc_tx' ),
+    'b': ( 'gpio', 'lo_b', 'ltc_rx' ),
+}
+
+LTC_DEVICES = {
+    'tx': ( 'ltc_tx', ),
+    'rx': ( 'ltc_rx', ),
+}
+
+RPC_SECONDS = metrics.Histogram("kalpana_rpc_seconds", "rpyc call latency", [ "method" ])
+RPC_ERRORS = metrics.Counter("kalpana_rpc_errors_total", "rpyc calls that raised", [ "method" ])
+HTTP_SECONDS = metrics.Histogram("kalpana_http_seconds", "REST request latency", [ "route", "status" ])
+
+
+def apply_setting(fn, *args):
+    # Coalesced settings are checked before they are queued, but return
+    # before they are applied, so nobody is left waiting to hear about
+    # a hardware failure
+    try:
+        fn(*args)
+    except Exception as e:
+        log.error(f"Failed to apply {fn.__name__}{args}: {e!r}")
 
-kalpana = Kalpana()
 
 flask_app = Flask("kalpanactld")
 
+@flask_app.before_request
+def start_timer():
+    g.start = time.perf_counter()
+
+@flask_app.after_request
+def record_request(response):
+    HTTP_SECONDS.observe(time.perf_counter() - g.start,
+                         request.endpoint or "unmatched", str(response.status_code))
+    return response
+
+@flask_app.route("/metrics")
+def flask_metrics():
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+@flask_app.route("/trace", methods=[ "GET", "POST", "PUT" ])
+def flask_trace():
+    # ?enable=1 starts recording spans, ?enable=0 stops, ?clear=1 empties
+    # the ring.  Returns what has been recorded as Chrome trace JSON.
+    if 'enable' in request.args:
+        if request.args.get('enable', type=int):
+            tracer.enable(request.args.get('capacity', type=int))
+        else:
+            tracer.disable()
+
+    if request.args.get('clear', type=int):
+        tracer.clear()
+
+    return Response(JSONEncoder().encode(tracer.chrome_trace()), mimetype="application/json")
+
 @flask_app.route("/")
 def hello():
     return "Rest API"
@@ -28,9 +107,12 @@ def flask_a_lo():
         try:
             new_freq = float(request.args.get('freq'))
             
-            kalpana.set_a_LO(new_freq)
-        except:
-            return f"Failed to set new frequency {e}"
+            hw.call(kalpana.set_a_LO, new_freq,
+                    devices=LO_DEVICES['a'], priority=hw.PRIO_RETUNE)
+        except (AssertionError, ValueError) as e:
+            return f"Failed to set new frequency: {e}", 400
+        except Exception as e:
+            return f"Failed to set new frequency: {e}", 500
 
     d = { 'frequency': kalpana.get_a_LO() }
         
@@ -42,26 +124,118 @@ def flask_b_lo():
         try:
             new_freq = float(request.args.get('freq'))
             
-            kalpana.set_b_LO(new_freq)
-        except:
-            return f"Failed to set new frequency {e}"
+            hw.call(kalpana.set_b_LO, new_freq,
+                    devices=LO_DEVICES['b'], priority=hw.PRIO_RETUNE)
+        except (AssertionError, ValueError) as e:
+            return f"Failed to set new frequency: {e}", 400
+        except Exception as e:
+            return f"Failed to set new frequency: {e}", 500
         
     d = { 'frequency': kalpana.get_b_LO() }
         
     return JSONEncoder().encode(d)
 
 
+@flask_app.route("/los", methods=[ "GET", "POST", "PUT" ])
+def flask_los():
+    if 'a' in request.args or 'b' in request.args:
+        try:
+            a = request.args.get('a', type=float)
+            b = request.args.get('b', type=float)
+
+            hw.call(kalpana.set_LOs, a, b,
+                    devices=LO_DEVICES['a'] + LO_DEVICES['b'], priority=hw.PRIO_RETUNE)
+        except (AssertionError, ValueError) as e:
+            return f"Failed to set new frequencies: {e}", 400
+        except Exception as e:
+            return f"Failed to set new frequencies: {e}", 500
+
+    d = { 'a': kalpana.get_a_LO(), 'b': kalpana.get_b_LO() }
+
+    return JSONEncoder().encode(d)
+
+
+@flask_app.route("/state", methods=[ "GET", "PUT" ])
+def flask_state():
+    if request.method == "PUT":
+        try:
+            state = request.get_json(force=True)
+
+            hw.call(kalpana.apply_state, state,
+                    devices=DEVICES, priority=hw.PRIO_RETUNE, flush=True)
+        except Exception as e:
+            return f"Failed to apply state {e}", 400
+
+    return JSONEncoder().encode(kalpana.get_state())
+
+
+@flask_app.route("/events")
+def flask_events():
+    # Server-sent events: the full state first, then every change as a
+    # delta in the same form
+    events = queue.SimpleQueue()
+    kalpana.subscribe(events.put)
+
+    def stream():
+        try:
+            yield f"data: {JSONEncoder().encode(kalpana.get_state())}\n\n"
+
+            while True:
+                try:
+                    delta = events.get(timeout=15)
+                except queue.Empty:
+                    # Lets us notice clients that went away
+                    yield ": keep-alive\n\n"
+                    continue
+
+                yield f"data: {JSONEncoder().encode(delta)}\n\n"
+        finally:
+            kalpana.unsubscribe(events.put)
+
+    return Response(stream(), mimetype="text/event-stream")
+
+
 def launch_flask():
     flask_app.run(host="0.0.0.0", port=5111)
     
 
+def rpc_timed(fn, method):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            RPC_ERRORS.inc(method)
+            raise
+        finally:
+            RPC_SECONDS.observe(time.perf_counter() - start, method)
+
+    return wrapper
+
+
+def instrument(cls):
+    # Times every exposed method of an rpyc service
+    for name in dir(cls):
+        if name.startswith("exposed_"):
+            setattr(cls, name, rpc_timed(getattr(cls, name), name[len("exposed_"):]))
+
+    return cls
+
+
+@instrument
 @rpyc.service
 class KalpanaCtlService(rpyc.Service):    
     def on_connect(self, conn):
-        print("Client connected")
+        log.info("Client connected")
+        self._subscriptions = []
         
     def on_disconnect(self, conn):
-        print("Client disconnected")
+        log.info("Client disconnected")
+
+        for notify in self._subscriptions:
+            kalpana.unsubscribe(notify)
 
     @rpyc.exposed
     def keep_alive(self) -> None:
@@ -77,23 +251,95 @@ class KalpanaCtlService(rpyc.Service):
     
     @rpyc.exposed
     def set_b_LO(self, f):
-        print(f"Setting B LO to {f}")
-        kalpana.set_b_LO(f)
+        log.info(f"Setting B LO to {f}")
+        return hw.call(kalpana.set_b_LO, f,
+                       devices=LO_DEVICES['b'], priority=hw.PRIO_RETUNE)
 
     @rpyc.exposed
     def set_a_LO(self, f):
-        print(f"Setting A LO to {f}")
-        kalpana.set_a_LO(f)
+        log.info(f"Setting A LO to {f}")
+        return hw.call(kalpana.set_a_LO, f,
+                       devices=LO_DEVICES['a'], priority=hw.PRIO_RETUNE)
+
+    @rpyc.exposed
+    def set_LOs(self, a, b):
+        log.info(f"Setting LOs to {a} {b}")
+        return hw.call(kalpana.set_LOs, a, b,
+                       devices=LO_DEVICES['a'] + LO_DEVICES['b'], priority=hw.PRIO_RETUNE)
+
+    @rpyc.exposed
+    def set_hop_list(self, lo, freqs):
+        return tuple(hw.call(kalpana.set_hop_list, lo, list(freqs),
+                             devices=LO_DEVICES[lo][:2], priority=hw.PRIO_BACKGROUND))
+
+    @rpyc.exposed
+    def get_hop_list(self, lo):
+        return tuple(kalpana.get_hop_list(lo))
+
+    @rpyc.exposed
+    def hop(self, lo, n):
+        # Hops do not switch the reference
+        return hw.call(kalpana.hop, lo, n,
+                       devices=LO_DEVICES[lo][1:], priority=hw.PRIO_RETUNE)
+
+    @rpyc.exposed
+    def subscribe(self, callback):
+        # callback gets every change as a JSON string in get_state() form.
+        # It is called asynchronously, so the client has to be serving
+        # its connection, e.g. with rpyc.BgServingThread.
+        callback = rpyc.async_(callback)
+
+        def notify(delta):
+            callback(JSONEncoder().encode(delta))
+
+        kalpana.subscribe(notify)
+        self._subscriptions.append(notify)
+
+    @rpyc.exposed
+    def get_state(self):
+        # JSON rather than a dict so the client gets everything in one
+        # round trip instead of a netref
+        return JSONEncoder().encode(kalpana.get_state())
+
+    @rpyc.exposed
+    def apply_state(self, state):
+        # Takes a JSON string with any subset of get_state()
+        state = hw.call(kalpana.apply_state, loads(state),
+                        devices=DEVICES, priority=hw.PRIO_RETUNE, flush=True)
+
+        return JSONEncoder().encode(state)
+
+    @rpyc.exposed
+    def get_config_error(self):
+        return kalpana.get_config_error()
+
+    @rpyc.exposed
+    def trace_start(self, capacity=None):
+        tracer.enable(capacity)
+
+    @rpyc.exposed
+    def trace_stop(self):
+        tracer.disable()
+
+    @rpyc.exposed
+    def get_trace(self, clear=False):
+        # Chrome trace JSON, for chrome://tracing or ui.perfetto.dev
+        trace = JSONEncoder().encode(tracer.chrome_trace())
+
+        if clear:
+            tracer.clear()
+
+        return trace
 
     @rpyc.exposed
     def get_gpio(self, chan):
-        print(f"Get GPIO {chan} {kalpana.get_gpio(chan)}")
+        log.debug(f"Get GPIO {chan} {kalpana.get_gpio(chan)}")
         return kalpana.get_gpio(chan)
         
     @rpyc.exposed
     def set_gpio(self, chan, v):
-        print(f"Setting GPIO {chan} to {v}")
-        kalpana.set_gpio(chan, v)
+        log.info(f"Setting GPIO {chan} to {v}")
+        hw.call(kalpana.set_gpio, chan, v, devices=( 'gpio', ))
 
     @rpyc.exposed
     def get_i_gain(self, chan):
@@ -107,34 +353,111 @@ class KalpanaCtlService(rpyc.Service):
     def get_phase_offset(self, chan):
         return kalpana.get_phase_offset(chan)
         
+    # The IQ, DC offset and gain setters are fed by sliders.  They return
+    # right away, and updates to the same setting arriving within the
+    # coalescing window are applied once, with the latest value.  Bad
+    # arguments still raise here, before anything is queued.
     @rpyc.exposed
     def set_i_gain(self, chan, v):
-        kalpana.set_i_gain(chan, v)
+        kalpana.check_i_gain(chan, v)
+        hw.coalesce(('i_gain', chan), apply_setting, kalpana.set_i_gain, chan, v,
+                    devices=LTC_DEVICES[chan])
         
     @rpyc.exposed
     def set_dc_offset(self, iq, chan, v):
-        kalpana.set_dc_offset(iq, chan, v)
+        kalpana.check_dc_offset(iq, chan, v)
+        hw.coalesce(('dc_offset', iq, chan), apply_setting, kalpana.set_dc_offset, iq, chan, v,
+                    devices=LTC_DEVICES[chan])
 
         
     @rpyc.exposed
     def set_phase_offset(self, chan, v):
-        kalpana.set_phase_offset(chan, v)
+        kalpana.check_phase_offset(chan, v)
+        hw.coalesce(('phase_offset', chan), apply_setting, kalpana.set_phase_offset, chan, v,
+                    devices=LTC_DEVICES[chan])
         
+    @rpyc.exposed
+    def store_calibration(self, chan):
+        hw.call(kalpana.store_calibration, chan, devices=LTC_DEVICES[chan])
+
+    @rpyc.exposed
+    def clear_calibration(self, chan):
+        hw.call(kalpana.clear_calibration, chan, devices=LTC_DEVICES[chan])
+
+    @rpyc.exposed
+    def get_calibration(self, chan):
+        return tuple(tuple(row) for row in kalpana.get_calibration(chan))
+
+    @rpyc.exposed
+    def get_gain(self, chan):
+        return kalpana.get_gain(chan)
+
+    @rpyc.exposed
+    def set_gain(self, chan, gain):
+        kalpana.check_gains({ chan: gain })
+        hw.coalesce(('gain', chan), apply_setting, kalpana.set_gain, chan, gain,
+                    devices=( 'dac', ))
+
     @rpyc.exposed
     def reset_lmx(self, chan, v):
-        print(f"Resetting LMX(s)")
-        kalpana.reset_lmx()
+        log.info(f"Resetting LMX(s)")
+        hw.call(kalpana.reset_lmx, devices=( 'lo_a', 'lo_b' ), priority=hw.PRIO_BACKGROUND)
         
+
+
+class CurieService(curie_pb2_grpc.CurieServicer):
+    # Gain control for host-side SDR software.  Each batch on the
+    # SetGains stream costs one scheduler round trip and one DAC update.
+    @staticmethod
+    def channel_name(isTX, channel):
+        return f"{'tx' if isTX else 'rx'}{channel}"
+
+    def status(self, isTX, channel):
+        return curie_pb2.GainStatus(isTX=isTX, channel=channel,
+                                    gain=kalpana.get_gain(self.channel_name(isTX, channel)))
+
+    def apply(self, requests, context):
+        gains = { self.channel_name(r.isTX, r.channel): r.gain for r in requests }
+
+        try:
+            hw.call(kalpana.set_gains, gains, devices=( 'dac', ))
+        except AssertionError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+        return [ self.status(r.isTX, r.channel) for r in requests ]
+
+    def SetGain(self, request, context):
+        return self.apply([ request ], context)[0]
+
+    def GetGain(self, request, context):
+        try:
+            return self.status(request.isTX, request.channel)
+        except Exception as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+    def SetGains(self, request_iterator, context):
+        for batch in request_iterator:
+            yield curie_pb2.GainStatusBatch(gains=self.apply(batch.gains, context))
+
+
+def launch_grpc(port=50051, workers=4):
+    server = grpc.server(ThreadPoolExecutor(max_workers=workers))
+    curie_pb2_grpc.add_CurieServicer_to_server(CurieService(), server)
+    server.add_insecure_port(f"[::]:{port}")
+    server.start()
+
+    return server
         
         
 @click.command()
-def kalpanactld():
-    print("Launching control daemon")
-
-    if not Path("/etc/kalpana.conf").exists():
-        print("Creating new configuration")
-        KalpanaConfig().dumps()
-    
+@click.option("--log-file", default="/tmp/kalpana-log", help="Log file, rotated by size; '-' for stderr")
+@click.option("--log-level", "log_levels", multiple=True, default=[ "INFO" ],
+              help="Level, or logger=level for one module, e.g. kalpanactl.ltc5594=TRACE. Repeatable.")
+@click.option("--trace", is_flag=True, help="Record a span timeline from startup on, see /trace")
+@click.option("--backend", envvar="KALPANA_BACKEND", default=None,
+              help="Device backend, 'periphery' or 'sim'; defaults to the configured one")
+def kalpanactld(log_file, log_levels, trace, backend):
+    # Fork the panel before anything starts threads or opens hardware
     pid = os.fork()
 
     if pid == 0:
@@ -142,9 +465,34 @@ def kalpanactld():
         os.system(f"python {Path(__file__).parent / 'ctrl_panel.py'}")
         exit()
 
+    level = "INFO"
+    levels = {}
+
+    for l in log_levels:
+        if "=" in l:
+            name, l = l.split("=", 1)
+            levels[name] = l
+        else:
+            level = l
+
+    kalpana_log.setup(None if log_file == "-" else log_file, level, levels)
+
+    log.info("Launching control daemon")
+
+    if trace:
+        tracer.enable()
+
+    setup(backend)
+
+    # Exit through SystemExit on SIGTERM so the pending configuration
+    # gets flushed on the way out
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
     flask_thread = threading.Thread(target=launch_flask)
     flask_thread.daemon=True
     flask_thread.start()
+
+    grpc_server = launch_grpc()
     
     t = rpyc.utils.server.ThreadedServer(KalpanaCtlService, port=37000)
     t.start()
@@ -1,6 +1,16 @@
-from periphery import SPI
-
+import logging
 import math
+import time
+
+from operator import attrgetter
+from collections import OrderedDict
+
+from .spi import SPITransaction, transfer, transfer_frames
+from .log import TRACE
+from .metrics import timed, PROGRAM_SECONDS
+from .trace import span, traced
+
+log = logging.getLogger(__name__)
 
 class LMX2820:
     VCO_MIN = 5.65e9
@@ -34,13 +44,69 @@ class LMX2820:
     VCO_BOUNDARIES = [ 5.65e9, 6.35e9, 7.3e9, 8.1e9, 9e9, 9.8e9, 10.6e9, 11.3e9 ]
 
     VCO_LIMITS = [ (0,0) ] + [ (lo, hi) for lo, hi in zip(VCO_BOUNDARIES[:-1], VCO_BOUNDARIES[1:]) ]
+
+    # R0..R112 are clocked out by program()
+    NUM_REGS = 113
+
+    # Register fields that set_fout() derives from the output frequency.
+    # Everything else is configuration and part of the plan cache key.
+    PLAN_ATTRS = ( '_outa_mux', '_chdiva', '_mult', '_plln', '_pll_num',
+                   '_pll_den', '_mash_order', '_vco_sel' )
+    
+    # Register fields overridden while hopping: FCAL is skipped and the
+    # VCO is forced to the band/capcode/DAC found during calibrate_hops(),
+    # with InstaCal and quick recall doing the residual fine tuning
+    HOP_MODE = { '_fcal_en': 0,
+                 '_instacal_en': 1,
+                 '_quick_recall_en': 1,
+                 '_vco_sel_force': 1,
+                 '_vco_capctrl_force': 1,
+                 '_vco_daciset_force': 1 }
+
+    # Readback fields as (register, shift, width)
+    RB_VCO_SEL = (74, 13, 3)
+    RB_VCO_CAPCTRL = (74, 5, 8)
+    RB_VCO_DACISET = (75, 0, 9)
+    RB_LD = (74, 0, 2)
+
+    # Read-only status registers, never compared against the image
+    READBACK_REGS = ( 74, 75, 76 )
+
+    LD_LOCKED = 2
     
-    def __init__(self, spi, f_in=10e6, f_outa=10e9, pwra=3):
+    def __init__(self, spi, f_in=10e6, f_outa=10e9, pwra=3, plan_cache_size=64, ld_gpio=None):
         self.init_regs_to_reset()
 
+        reg_attrs = [ k for k in vars(self) if k not in ('_R', '_regs') ]
+        self._reg_state = attrgetter(*reg_attrs)
+        self._config_state = attrgetter(*[ k for k in reg_attrs if k not in self.PLAN_ATTRS ])
+
         self._spi = spi
         self._f_in = f_in
 
+        # Optional input GPIO on MUXOUT in lock-detect mode, opened
+        # with edge="rising".  Without it lock is polled over SPI.
+        self._ld_gpio = ld_gpio
+
+        # LRU of (f_in, fout, config) -> (plan, register image)
+        self._plans = OrderedDict()
+        self._plan_cache_size = plan_cache_size
+
+        # Register image for the current state as (state, image), so
+        # program() can skip evaluating the register lambdas
+        self._image = None
+
+        # Image of what was last written to the chip.  None means
+        # the chip contents are unknown and the next program() has
+        # to write every register.
+        self._shadow = None
+
+        # Calibrated hop states, and the normal-mode values of the
+        # HOP_MODE fields while a hop is active
+        self._hops = []
+        self._hop_images = []
+        self._normal_mode = None
+
         self.set_fout(f_outa)
 
     @property
@@ -65,7 +131,95 @@ class LMX2820:
     def fout(self):
         return self._fout
 
+    @traced("LMX2820.set_fout")
     def set_fout(self, a, b=None):
+        if self._normal_mode is not None:
+            self.__dict__.update(self._normal_mode)
+            self._normal_mode = None
+
+        key = (self._f_in, a, self._config_state(self))
+
+        try:
+            plan, image = self._plans[key]
+            self._plans.move_to_end(key)
+            self.__dict__.update(plan)
+        except KeyError:
+            self.plan_fout(a)
+
+            plan = { k: getattr(self, k) for k in self.PLAN_ATTRS }
+            image = tuple(self.image())
+
+            self._plans[key] = (plan, image)
+
+            if len(self._plans) > self._plan_cache_size:
+                self._plans.popitem(last=False)
+
+        self._fout = a
+        self._image = (self._reg_state(self), image)
+
+    def preload(self, freqs):
+        # Plan every frequency with the current configuration, then
+        # put the current state back
+        saved = dict(self.__dict__)
+
+        for f in freqs:
+            self.set_fout(f)
+
+        self.__dict__.update(saved)
+
+    @property
+    def hops(self):
+        return [ hop['_fout'] for hop in self._hops ]
+
+    @traced("LMX2820.calibrate_hops")
+    def calibrate_hops(self, freqs, timeout=0.01):
+        # Run a full FCAL at every hop frequency and keep the VCO
+        # calibration the chip settled on
+        fout = self._fout
+        hops = []
+
+        for f in freqs:
+            self.set_fout(f)
+            self.program()
+            self.wait_lock(timeout)
+
+            hop = { k: getattr(self, k) for k in self.PLAN_ATTRS }
+
+            hop.update(self.HOP_MODE)
+            hop['_vco_sel'] = self.read_field(self.RB_VCO_SEL)
+            hop['_vco_capctrl'] = self.read_field(self.RB_VCO_CAPCTRL)
+            hop['_vco_daciset'] = self.read_field(self.RB_VCO_DACISET)
+
+            # InstaCal takes the fractional part scaled to 2^32
+            hop['_instacal_pll_num'] = (self._pll_num << 32) // self._pll_den
+            hop['_fout'] = f
+
+            hops.append(hop)
+
+        self._hops = hops
+        self._hop_images = [ None ] * len(hops)
+
+        self.set_fout(fout)
+        self.program()
+
+        return self.hops
+
+    @traced("LMX2820.hop")
+    def hop(self, n):
+        hop = self._hops[n]
+
+        if self._normal_mode is None:
+            self._normal_mode = { k: getattr(self, k) for k in hop if k != '_fout' }
+
+        self.__dict__.update(hop)
+        self._image = self._hop_images[n]
+        self.program()
+        self._hop_images[n] = self._image
+
+        return self._fout
+
+    @traced("LMX2820.plan_fout")
+    def plan_fout(self, a):
         #print(f"Setting VCO to {a}")
         f_vco = a
         enable_doubler = False
@@ -116,13 +270,10 @@ class LMX2820:
 
         self._vco_sel = self.get_vco(f_vco)
         
-        self._fout = a
-
-        
-        
-        print(f"VCO frequency: {f_vco} VCO no: {self._vco_sel}")
-        print(f"PLL: int n: {self._plln} num: {self._pll_num} den: {self._pll_den}")
-        print(f"Freq: {self.f_pfd * (self._plln + self._pll_num / self._pll_den) / (1 << (self._chdiva + 1))}")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f"VCO frequency: {f_vco} VCO no: {self._vco_sel}")
+            log.debug(f"PLL: int n: {self._plln} num: {self._pll_num} den: {self._pll_den}")
+            log.debug(f"Freq: {self.f_pfd * (self._plln + self._pll_num / self._pll_den) / (1 << (self._chdiva + 1))}")
 
     def get_vco(self, f):
         if f < self.VCO_LIMITS[1][0] or f > self.VCO_LIMITS[-1][1]:
@@ -412,10 +563,53 @@ class LMX2820:
     def regs(self):
         return self._regs
 
-    def program_register(self, i):
-        v = self.regs[i] | (i << 16)
-        data = [ (v >> i) & 0xFF for i in [ 16, 8, 0 ] ]
-        miso = self._spi.transfer(data)
+    @staticmethod
+    def frame(i, v):
+        v |= (i << 16)
+        return [ (v >> s) & 0xFF for s in [ 16, 8, 0 ] ]
+
+    def program_register(self, i, v=None):
+        if v is None:
+            v = self.regs[i]
+
+        miso = transfer(self._spi, self.frame(i, v))
+
+    def read_register(self, i):
+        miso = transfer(self._spi, [ 0x80 | i, 0, 0 ])
+
+        return (miso[1] << 8) | miso[2]
+
+    def read_field(self, field):
+        i, shift, width = field
+
+        return (self.read_register(i) >> shift) & ((1 << width) - 1)
+
+    @property
+    def locked(self):
+        if self._ld_gpio is not None:
+            return self._ld_gpio.read()
+
+        return self.read_field(self.RB_LD) == self.LD_LOCKED
+
+    @traced("LMX2820.wait_lock")
+    def wait_lock(self, timeout=0.01, poll=50e-6):
+        # Returns the time it took to see lock, in seconds
+        start = time.monotonic()
+        deadline = start + timeout
+
+        while not self.locked:
+            remaining = deadline - time.monotonic()
+
+            if remaining <= 0:
+                raise TimeoutError(f"LMX2820 did not lock at {self._fout} within {timeout}s")
+
+            if self._ld_gpio is not None:
+                if self._ld_gpio.poll(remaining):
+                    self._ld_gpio.read_event()
+            else:
+                time.sleep(min(poll, remaining))
+
+        return time.monotonic() - start
         
 
     def reset(self):
@@ -426,12 +620,77 @@ class LMX2820:
         self._reset = 0
 
         self.program_register(0)
+
+        # Everything is back at power-on defaults
+        self._shadow = None
+
+    def image(self):
+        state = self._reg_state(self)
+
+        if self._image is None or self._image[0] != state:
+            with span("LMX2820.evaluate_registers"):
+                r = self.regs
+                self._image = (state, tuple(r[i] for i in range(self.NUM_REGS)))
+
+        return list(self._image[1])
+
+    def read_image(self):
+        # Every register in one SPI message rather than one each
+        frames = [ [ 0x80 | i, 0, 0 ] for i in range(self.NUM_REGS) ]
+
+        return [ (miso[1] << 8) | miso[2] for miso in transfer_frames(self._spi, frames) ]
+
+    def warm_start(self):
+        # Take what the chip currently holds as the shadow, so the next
+        # program() only writes registers that differ from the plan.
+        # A chip that is not locked gets programmed from scratch.
+        if not self.locked:
+            self._shadow = None
+            return
+
+        image = self.image()
+        shadow = self.read_image()
+
+        for i in self.READBACK_REGS:
+            shadow[i] = image[i]
+
+        self._shadow = shadow
+
+    @property
+    def in_sync(self):
+        return not self.changed_registers(self.image())
+
+    def changed_registers(self, image):
+        if self._shadow is None:
+            return list(range(self.NUM_REGS - 1, -1, -1))
+
+        changed = [ i for i in range(self.NUM_REGS - 1, 0, -1) if image[i] != self._shadow[i] ]
+
+        # R0 goes last whenever anything changed: it latches the
+        # double-buffered PLL registers and kicks off FCAL
+        if changed or image[0] != self._shadow[0]:
+            changed.append(0)
+
+        return changed
         
-    def program(self):
-        r = self.regs
+    @timed(PROGRAM_SECONDS, "LMX2820")
+    @traced("LMX2820.program")
+    def program(self, full=False):
+        if full:
+            self._shadow = None
+
+        image = self.image()
+
+        trace = log.isEnabledFor(TRACE)
+
+        with SPITransaction(self._spi) as t:
+            for i in self.changed_registers(image):
+                if trace:
+                    log.log(TRACE, f"R{i} = 0x{image[i]:04x}")
+
+                t.write(self.frame(i, image[i]))
 
-        for i in range(112, -1, -1):
-            self.program_register(i)
+        self._shadow = image
         
     
 if __name__ == '__main__':
@@ -0,0 +1,66 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+# Below DEBUG, for register-level traffic.  Guard anything on a hot path
+# with log.isEnabledFor(TRACE) so it costs nothing when disabled.
+TRACE = 5
+logging.addLevelName(TRACE, "TRACE")
+
+FORMAT = "%(asctime)s %(levelname)s %(name)s [%(threadName)s] %(message)s"
+
+_listener = None
+
+
+def parse_level(level):
+    if isinstance(level, int):
+        return level
+
+    return logging.getLevelNamesMapping()[level.upper()]
+
+
+def setup(path=None, level="INFO", levels=None, max_bytes=4 << 20, backups=3):
+    """Send all logging through a queue to a background thread, which
+    formats the records and writes them to path (rotated once it
+    reaches max_bytes) or stderr.  Callers never wait on the disk.
+
+    levels maps logger names to levels, e.g.
+    { 'kalpanactl.ltc5594': 'TRACE' }.
+    """
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+
+    if path is None:
+        handler = logging.StreamHandler(sys.stderr)
+    else:
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+
+    handler.setFormatter(logging.Formatter(FORMAT))
+
+    q = queue.SimpleQueue()
+
+    root = logging.getLogger()
+    root.handlers = [ logging.handlers.QueueHandler(q) ]
+    root.setLevel(parse_level(level))
+
+    for name, l in (levels or {}).items():
+        logging.getLogger(name).setLevel(parse_level(l))
+
+    _listener = logging.handlers.QueueListener(q, handler, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown():
+    # Drains the queue; registered to run at exit
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown)
@@ -1,26 +1,107 @@
+import logging
 import time
 
+from .spi import SPITransaction, transfer
+from .metrics import timed, PROGRAM_SECONDS
+from .trace import span, traced
+
+log = logging.getLogger(__name__)
+
 class LTC2668:
     CMD_WRITE_CODE = 0x00
     CMD_WRITE_SPAN = 0x60
+    CMD_WRITE_SPAN_ALL = 0xE0
     CMD_WRITE_CODE_ALL = 0x80
     CMD_UPDATE = 0x10
+    CMD_UPDATE_ALL = 0x90
     CMD_WCU = 0x30
     CMD_WCUA = 0x20
     CMD_WCAUA = 0xA0
     CMD_POWER_DOWN = 0x40
     CMD_POWER_DOWN_CHIP = 0x50
-    
 
-    
+    NUM_CHANNELS = 16
+
+    # +/-2.5V output span
+    SPAN_PM2V5 = 0x04
+
     def __init__(self, spi):
         self._spi = spi
 
+        # Span each channel was last programmed to, None if unknown
+        self._spans = [ None ] * self.NUM_CHANNELS
+
+        # Codes written by stage() but not yet latched, per channel
+        self._staged = {}
+
+    @staticmethod
+    def code(V):
+        assert V >= -2.5 and V <= 2.5, f"Voltage ({V}) must be between -2.5 and 2.5"
+
+        return min(int((V + 2.5) / 5 * 65535), 0xFFFF)
+
+    def _program_spans(self, channels):
+        todo = [ c for c in channels if self._spans[c] != self.SPAN_PM2V5 ]
+
+        if not todo:
+            return
+
+        with SPITransaction(self._spi) as t:
+            if len(todo) > 1:
+                t.write([ self.CMD_WRITE_SPAN_ALL, 0x00, self.SPAN_PM2V5 ])
+                todo = range(self.NUM_CHANNELS)
+            else:
+                t.write([ self.CMD_WRITE_SPAN | todo[0], 0x00, self.SPAN_PM2V5 ])
+
+        for c in todo:
+            self._spans[c] = self.SPAN_PM2V5
+
+        with span("LTC2668.span_settle"):
+            time.sleep(0.01)
+
     def setV(self, channel, V):
-        code = int((V + 2.5) / 5 * 65535)
+        code = self.code(V)
+
+        log.debug(f"Sending code {code:x} for {V}V...")
+
+        self._program_spans([ channel ])
+        transfer(self._spi, [ self.CMD_WCU | channel, code >> 8, code & 0xFF ])
+
+    def stage(self, channel, V):
+        assert channel >= 0 and channel < self.NUM_CHANNELS
+
+        self._staged[channel] = self.code(V)
+
+    @timed(PROGRAM_SECONDS, "LTC2668")
+    @traced("LTC2668.update")
+    def update(self):
+        # Write every staged code in one SPI message; the last write
+        # also updates all channels so they change at the same instant
+        staged, self._staged = self._staged, {}
+
+        if not staged:
+            return
+
+        self._program_spans(staged)
+
+        channels = list(staged)
+
+        with SPITransaction(self._spi) as t:
+            for c in channels[:-1]:
+                t.write([ self.CMD_WRITE_CODE | c, staged[c] >> 8, staged[c] & 0xFF ])
+
+            c = channels[-1]
+            t.write([ self.CMD_WCUA | c, staged[c] >> 8, staged[c] & 0xFF ])
+
+    def setVs(self, voltages):
+        # Takes { channel: V }
+        for channel, V in voltages.items():
+            self.stage(channel, V)
+
+        self.update()
 
-        print(f"Sending code {code:x} for {V}V...")
+    def setVAll(self, V):
+        code = self.code(V)
 
-        self._spi.transfer([0xE0, 0x00, 0x04])
-        time.sleep(0.01)
-        self._spi.transfer([ self.CMD_WCU | channel, code >> 8, code & 0xFF ])
+        self._program_spans(range(self.NUM_CHANNELS))
+        transfer(self._spi, [ self.CMD_WCAUA, code >> 8, code & 0xFF ])
@@ -1,5 +1,16 @@
-from periphery import SPI
-import sys
+import logging
+import math
+
+from bisect import bisect_right
+
+import numpy as np
+
+from .spi import SPITransaction, transfer
+from .log import TRACE
+from .metrics import timed, PROGRAM_SECONDS
+from .trace import traced
+
+log = logging.getLogger(__name__)
 
 
 def reg_property(n, start_bit=0, bit_len=8):
@@ -9,12 +20,15 @@ def reg_property(n, start_bit=0, bit_len=8):
             return (obj.regs[n] >> start_bit) & mask
 
         def __set__(self, obj, value):
-            #print(f"{obj} {value}")
-            sys.stdout.flush()
-            obj.regs[n] = (obj.regs[n] &
-                           ~(mask << start_bit) |
-                           ((value & mask) << start_bit))
-            obj.dirty[n] = True
+            v = (obj.regs[n] &
+                 ~(mask << start_bit) |
+                 ((value & mask) << start_bit))
+
+            # Settings that quantize to the same code leave the
+            # register clean
+            if v != obj.regs[n]:
+                obj.regs[n] = v
+                obj.dirty[n] = True
 
     return reg_obj()
                            
@@ -24,12 +38,49 @@ class LTC5594:
     REG_CTRL = 0x16
     REG_CID = 0x17
     REG_AMP = 0x15
+
+    # CTRL bits the driver sets, the rest don't read back as written
+    CTRL_MASK = 0xF4
+
+    # LO band plan as (upper frequency bound, band, cf1, lf1, cf2).
+    # An entry applies below its bound; the last one covers the rest.
+    BAND_PLAN = [
+        ( 339e6,    0, 31, 3, 31 ),
+        ( 398e6,    0, 21, 3, 24 ),
+        ( 419e6,    0, 14, 3, 23 ),
+        ( 556e6,    0, 17, 2, 31 ),
+        ( 625e6,    0, 10, 2, 23 ),
+        ( 801e6,    0, 15, 1, 31 ),
+        ( 831e6,    0, 14, 1, 27 ),
+        ( 1046e6,   0,  8, 1, 21 ),
+        ( 1242e6,   1, 31, 3, 31 ),
+        ( 1411e6,   1, 21, 3, 28 ),
+        ( 1696e6,   1, 17, 2, 26 ),
+        ( 2070e6,   1, 15, 1, 31 ),
+        ( 2470e6,   1,  8, 1, 21 ),
+        ( 2980e6,   1,  2, 1, 10 ),
+        ( 3500e6,   1,  1, 0, 19 ),
+        ( math.inf, 1,  0, 0,  0 ),
+    ]
+
+    BAND_EDGES = [ entry[0] for entry in BAND_PLAN[:-1] ]
     
-    def __init__(self, spidev):
+    def __init__(self, spidev, warm=False):
         self.spidev = spidev
 
-        self.regs = [ self.read_reg(i) for i in range(0x18) ]
-        self.dirty = [ True ] * 0x18
+        # Index into BAND_PLAN of the band registers' current contents
+        self._band_entry = None
+
+        # What the chip holds.  On a warm start that is whatever is
+        # already there, and program() only writes what differs.
+        if warm:
+            self._shadow = [ self.read_reg(i) for i in range(self.REG_CID) ] + [ None ]
+            self._shadow[self.REG_CTRL] &= self.CTRL_MASK
+        else:
+            self._shadow = [ None ] * 0x18
+
+        # The chip ID is read only and never written
+        self.dirty = [ True ] * self.REG_CID + [ False ]
 
         self.regs = [ 0 ] * 0x18
         self._default_regs()
@@ -58,7 +109,7 @@ class LTC5594:
     cf1 = reg_property(0x12, 0, 5)
     lvcm = reg_property(0x12, 5, 3)
     cf2 = reg_property(0x13, 0, 5)
-    lf = reg_property(0x13, 5, 2)
+    lf1 = reg_property(0x13, 5, 2)
     band = reg_property(0x13, 7, 1)
     
     ampic = reg_property(0x14, 0, 2)
@@ -74,10 +125,13 @@ class LTC5594:
     
     @property
     def phase(self):
-        return (self.regs(0x14) << 1) | (self.regs(0x15) >> 7)
+        return (self.regs[0x14] << 1) | (self.regs[0x15] >> 7)
 
     @phase.setter
     def phase(self, v):
+        if v == self.phase:
+            return
+
         self.regs[0x14] = v >> 1
         self.regs[0x15] = (self.regs[0x15] & 0x7F) | ((v & 1) << 7)
         self.dirty[0x14] = True
@@ -121,104 +175,42 @@ class LTC5594:
         self.pha = 0x100
         self.sdo_mode = 0
 
+    @classmethod
+    def band_entry(cls, freq):
+        return bisect_right(cls.BAND_EDGES, freq)
+
+    @classmethod
+    def band_settings(cls, freqs):
+        # Maps an array of frequencies to rows of (band, cf1, lf1, cf2)
+        idx = np.searchsorted(cls.BAND_EDGES, freqs, side='right')
+
+        return np.array([ entry[1:] for entry in cls.BAND_PLAN ])[idx]
+
     def set_freq(self, freq):
-        print(f"LTC5594 being configured for Frequency {freq}")
-        sys.stdout.flush()
-
-        if freq < 339e6:
-            self.band = 0
-            self.cf1 = 31
-            self.lf1 = 3
-            self.cf2 = 31
-        elif freq < 398e6:
-            self.band = 0
-            self.cf1 = 21
-            self.lf1 = 3
-            self.cf2 = 24
-        elif freq < 419e6:
-            self.band = 0
-            self.cf1 = 14
-            self.lf1 = 3
-            self.cf2 = 23
-        elif freq < 556e6:
-            self.band = 0
-            self.cf1 = 17
-            self.lf1 = 2
-            self.cf2 = 31
-        elif freq < 625e6:
-            self.band = 0
-            self.cf1 = 10
-            self.lf1 = 2
-            self.cf2 = 23
-        elif freq < 801e6:
-            self.band = 0
-            self.cf1 = 15
-            self.lf1 = 1
-            self.cf2 = 31
-        elif freq < 831e6:
-            self.band = 0
-            self.cf1 = 14
-            self.lf1 = 1
-            self.cf2 = 27
-        elif freq < 1046e6:
-            self.band = 0
-            self.cf1 = 8
-            self.lf1 = 1
-            self.cf2 = 21
-        elif freq < 1242e6:
-            self.band = 1
-            self.cf1 = 31
-            self.lf1 = 3
-            self.cf2 = 31
-        elif freq < 1411e6:
-            self.band = 1
-            self.cf1 = 21
-            self.lf1 = 3
-            self.cf2 = 28
-        elif freq < 1696e6:
-            self.band = 1
-            self.cf1 = 17
-            self.lf1 = 2
-            self.cf2 = 26
-        elif freq < 2070e6:
-            self.band = 1
-            self.cf1 = 15
-            self.lf1 = 1
-            self.cf2 = 31
-        elif freq< 2470e6:
-            self.band = 1
-            self.cf1 = 8
-            self.lf1 = 1
-            self.cf2 = 21
-        elif freq < 2980e6:
-            self.band = 1
-            self.cf1 = 2
-            self.lf1 = 1
-            self.cf2 = 10
-        elif freq < 3500e6:
-            self.band = 1
-            self.cf1 = 1
-            self.lf1 = 0
-            self.cf2 = 19
-        else:
-            self.band = 1
-            self.cf1 = 0
-            self.lf1 = 0
-            self.cf2 = 0
+        i = self.band_entry(freq)
+
+        # Nothing to do, or to program, inside the current band
+        if i == self._band_entry:
+            return
+
+        log.debug(f"LTC5594 being configured for Frequency {freq}")
+
+        _, self.band, self.cf1, self.lf1, self.cf2 = self.BAND_PLAN[i]
+        self._band_entry = i
 
     # IQ Corrections for Sideband Suppression
     def set_i_gain(self, gain):
-        print(f"Sideband Suppression I Gain offset is {gain}")
+        log.debug(f"Sideband Suppression I Gain offset is {gain}")
         self.gerr = int((gain + 0.5)*63) & 0x3F
 
     # IQ Corrections for Sideband Suppression
     def set_phase_offset(self, offset):
-        print(f"Phase offset is {offset}")
+        log.debug(f"Phase offset is {offset}")
         self.phase = int((offset + 2.5) / 5 * 255) & 0xFF
 
     # DC Offsets for LO Suppression
     def set_dc_offset(self, iq, offset):
-        print(f"LO Suppression DC Offset is {offset}")
+        log.debug(f"LO Suppression DC Offset is {offset}")
         code = int((offset + 200) / 400 * 255) & 0xFF
         
         if iq == "I":
@@ -228,33 +220,47 @@ class LTC5594:
             
         
             
+    @timed(PROGRAM_SECONDS, "LTC5594")
+    @traced("LTC5594.program")
     def program(self):
-        for i, d in enumerate(self.dirty):
-            if not d:
-                continue
+        trace = log.isEnabledFor(TRACE)
+
+        with SPITransaction(self.spidev) as t:
+            for i, d in enumerate(self.dirty):
+                if not d:
+                    continue
+
+                self.dirty[i] = False
 
-            self.write_reg(i, check=False)
-            self.dirty[i] = False
+                if self.regs[i] == self._shadow[i]:
+                    continue
 
-        sys.stdout.flush()
+                if trace:
+                    log.log(TRACE, f"{i:x} {self.regs[i]:x}")
+
+                t.write([ i, self.regs[i] ])
+                self._shadow[i] = self.regs[i]
                                    
     def dump_regs(self):
         for i in range(0x18):
             v = self.read_reg(i)
-            output.print(f"{i}: {v:02x}")
+            log.info(f"{i}: {v:02x}")
             
     def read_reg(self, reg_no : int):
         assert(reg_no < 0x18)
-        r = self.spidev.transfer([ 0x80 | reg_no, 0 ])
+        r = transfer(self.spidev, [ 0x80 | reg_no, 0 ])
 
         return r[1]
 
     def write_reg(self, reg_no : int, check=False):
-        print(f"{reg_no:x} {self.regs[reg_no]:x}")
-        sys.stdout.flush()
         assert(reg_no < 0x18)
-        r = self.spidev.transfer([ reg_no, self.regs[reg_no] ])
+
+        if log.isEnabledFor(TRACE):
+            log.log(TRACE, f"{reg_no:x} {self.regs[reg_no]:x}")
+
+        r = transfer(self.spidev, [ reg_no, self.regs[reg_no] ])
         self.dirty[reg_no] = False
+        self._shadow[reg_no] = self.regs[reg_no]
 
         if check and reg_no != 0x16:
            vr = self.read_reg(reg_no)
@@ -0,0 +1,192 @@
+import functools
+import threading
+import time
+
+from bisect import bisect_left
+
+
+class Registry:
+    """Counters and histograms cheap enough to update on every SPI
+    transfer.
+
+    Every thread updates a shard of its own, so recording takes no locks
+    and never contends.  Rendering adds the shards up; copying a shard is
+    a single dict.copy(), which the GIL makes atomic.  Shards of threads
+    that have exited (e.g. one per Flask request) are folded together so
+    they do not pile up.
+    """
+    def __init__(self):
+        self._metrics = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        # (thread, shard) of live threads, and the sum of the dead ones
+        self._shards = []
+        self._retired = {}
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            pass
+
+        shard = self._local.shard = {}
+
+        with self._lock:
+            self._shards.append((threading.current_thread(), shard))
+
+        return shard
+
+    def collect(self):
+        # Sum of all shards as { (metric, labels): value }
+        with self._lock:
+            live = []
+
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    self._merge(self._retired, shard)
+
+            self._shards = live
+
+            total = {}
+            self._merge(total, self._retired)
+
+            for thread, shard in live:
+                self._merge(total, shard.copy())
+
+        return total
+
+    @staticmethod
+    def _merge(total, shard):
+        for key, v in shard.items():
+            if isinstance(v, list):
+                t = total.setdefault(key, [ 0 ] * len(v))
+                for i, x in enumerate(v):
+                    t[i] += x
+            else:
+                total[key] = total.get(key, 0) + v
+
+    def render(self):
+        # Prometheus text exposition format
+        values = self.collect()
+        lines = []
+
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.TYPE}")
+
+            # Labels are sorted as they are rendered, so None or numbers
+            # mixed in with strings cannot break a scrape
+            samples = sorted(((labels, v) for (m, labels), v in values.items() if m is metric),
+                             key=lambda sample: tuple(map(str, sample[0])))
+
+            for labels, v in samples:
+                lines += metric.render(labels, v)
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+
+    if not pairs:
+        return ""
+
+    return "{" + ",".join(f'{n}="{v}"' for n, v in pairs) + "}"
+
+
+class Counter:
+    TYPE = "counter"
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._registry = registry
+        registry.register(self)
+
+    def inc(self, *labels, n=1):
+        shard = self._registry.shard()
+        key = (self, labels)
+        shard[key] = shard.get(key, 0) + n
+
+    def render(self, labels, v):
+        return [ f"{self.name}{_labels(self.labelnames, labels)} {v}" ]
+
+
+class Histogram:
+    TYPE = "histogram"
+
+    # Seconds, from a cached LTC5594 write to a full LMX calibration
+    BUCKETS = ( 10e-6, 25e-6, 50e-6, 100e-6, 250e-6, 500e-6,
+                1e-3, 2.5e-3, 5e-3, 10e-3, 25e-3, 50e-3, 100e-3, 250e-3, 1.0 )
+
+    def __init__(self, name, help, labelnames=(), buckets=BUCKETS, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._registry = registry
+        registry.register(self)
+
+    def observe(self, v, *labels):
+        shard = self._registry.shard()
+        key = (self, labels)
+
+        # Per-bucket counts (the last one is +Inf), then sum and count
+        counts = shard.get(key)
+
+        if counts is None:
+            counts = shard[key] = [ 0 ] * (len(self.buckets) + 3)
+
+        counts[bisect_left(self.buckets, v)] += 1
+        counts[-2] += v
+        counts[-1] += 1
+
+    def render(self, labels, v):
+        lines = []
+        cumulative = 0
+
+        for le, n in zip(self.buckets + ( "+Inf", ), v):
+            cumulative += n
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, [ ( 'le', le ) ])} {cumulative}")
+
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {v[-2]}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {v[-1]}")
+
+        return lines
+
+
+def timed(histogram, *labels):
+    # Decorator recording how long every call takes
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, *labels)
+
+        return wrapper
+
+    return decorator
+
+
+# Shared by the drivers and the daemon
+PROGRAM_SECONDS = Histogram("kalpana_program_seconds",
+                            "Time spent in driver program() calls", [ "driver" ])
+SPI_FRAMES = Counter("kalpana_spi_frames_total",
+                     "SPI frames (chip select assertions) sent", [ "device" ])
+SPI_BYTES = Counter("kalpana_spi_bytes_total",
+                    "SPI bytes sent", [ "device" ])
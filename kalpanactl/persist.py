@@ -0,0 +1,146 @@
+import atexit
+import logging
+import os
+import threading
+import time
+
+from pathlib import Path
+
+from .metrics import Counter
+from .trace import traced
+
+log = logging.getLogger(__name__)
+
+SAVE_FAILURES = Counter("kalpana_config_save_failures_total",
+                        "Failed attempts to save the configuration")
+
+
+class ConfigPersister:
+    """Writes the configuration from a background thread.
+
+    schedule() only marks the configuration dirty; any number of changes
+    made before the thread gets to it end up in a single write.  Writes
+    go to a temporary file which is fsynced and renamed over the real one,
+    so after a power loss the file holds either the old or the new
+    configuration, never a torn mix.  Without write access to the
+    directory (/etc when not running as root) the file is rewritten in
+    place instead.  At most one write happens every min_interval seconds
+    to spare the SD card.
+
+    A failed write is retried up to max_failures times in a row, then
+    given up on until the next change.  error holds the last failure,
+    None once a write succeeds.
+    """
+    def __init__(self, path, dump, min_interval=1.0, max_failures=5):
+        self._path = Path(path)
+        self._dump = dump
+        self._min_interval = min_interval
+        self._max_failures = max_failures
+
+        self.failures = 0
+        self.error = None
+
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._pending = False
+        self._last_write = 0
+
+        self._thread = threading.Thread(target=self._run, name="config-persister", daemon=True)
+        self._thread.start()
+
+        atexit.register(self.flush)
+
+    def schedule(self):
+        with self._cond:
+            self._pending = True
+            self._cond.notify()
+
+    def flush(self):
+        # Write out anything pending right now, from the calling thread.
+        # Returns False if that failed, see error.
+        with self._cond:
+            if not self._pending:
+                return True
+
+            self._pending = False
+
+        return self._save()
+
+    @traced("save_config")
+    def write(self):
+        with self._write_lock:
+            data = self._dump()
+
+            if os.access(self._path.parent, os.W_OK):
+                self._replace(data)
+            else:
+                self._overwrite(data)
+
+            self._last_write = time.monotonic()
+
+    def _replace(self, data):
+        tmp = self._path.with_name(self._path.name + ".tmp")
+
+        with open(tmp, "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp, self._path)
+
+        # Make the rename itself durable
+        fd = os.open(self._path.parent, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _overwrite(self, data):
+        # Not atomic, a power loss mid-write can tear the file
+        with open(self._path, "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _save(self):
+        try:
+            self.write()
+        except OSError as e:
+            self.failures += 1
+            self.error = f"Failed to save configuration to {self._path}: {e}"
+            SAVE_FAILURES.inc()
+            log.error(self.error)
+            return False
+
+        self.failures = 0
+        self.error = None
+
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+
+            # Let further changes pile up until we are allowed to write
+            delay = self._last_write + self._min_interval - time.monotonic()
+
+            if delay > 0:
+                time.sleep(delay)
+
+            with self._cond:
+                if not self._pending:
+                    continue
+
+                self._pending = False
+
+            if self._save():
+                continue
+
+            if self.failures >= self._max_failures:
+                log.error(f"Giving up on saving the configuration after {self.failures} attempts")
+                continue
+
+            self.schedule()
+            time.sleep(self._min_interval)
@@ -0,0 +1,150 @@
+import functools
+import itertools
+import queue
+import threading
+
+from concurrent.futures import Future
+
+
+class HardwareScheduler:
+    """Owns the hardware on behalf of the daemon's frontends.
+
+    Commands are queued by priority and run on the scheduler's worker
+    thread(s), so rpyc and Flask threads never touch SPI or GPIO
+    themselves.  Each command names the devices it uses; a worker holds
+    those devices' locks while it runs, which keeps commands on the same
+    device serialized even with more than one worker.
+
+    A running command must not call back into the scheduler and wait on
+    the result, with a single worker that deadlocks.
+
+    coalesce() is for high-rate settings such as slider drags: commands
+    under the same key collapse into one until a worker picks them up,
+    and only the latest arguments are applied.  A command submitted with
+    flush=True first runs the coalesced commands on its devices that
+    have not started yet, so none of them can land after it.
+    """
+    # Lower runs first
+    PRIO_RETUNE = 0
+    PRIO_SETTING = 10
+    PRIO_BACKGROUND = 20
+
+    def __init__(self, devices, workers=1):
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._locks = { d: threading.Lock() for d in devices }
+
+        # key -> queue entry of coalesced commands that have not started
+        # yet, see coalesce()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+        self._workers = [
+            threading.Thread(target=self._run, name=f"hw-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+
+        for t in self._workers:
+            t.start()
+
+    def _check_devices(self, devices):
+        for d in devices:
+            if d not in self._locks:
+                raise ValueError(f"Unknown device {d}")
+
+        return sorted(set(devices))
+
+    def submit(self, fn, *args, devices=(), priority=PRIO_SETTING, flush=False, **kwargs):
+        devices = self._check_devices(devices)
+
+        if flush:
+            fn = functools.partial(self._run_pending, self._take_pending(devices), fn)
+
+        future = Future()
+
+        # The sequence number keeps equal priorities in FIFO order
+        self._queue.put((priority, next(self._seq), None, [ fn, args, kwargs, future ], devices))
+
+        return future
+
+    def coalesce(self, key, fn, *args, devices=(), priority=PRIO_SETTING, window=0.02, **kwargs):
+        # Like submit(), but the command waits window seconds before it
+        # is queued.  Until a worker starts it, further commands under
+        # the same key replace its arguments and share its future.
+        devices = self._check_devices(devices)
+
+        with self._pending_lock:
+            entry = self._pending.get(key)
+
+            if entry is not None:
+                entry[3][:3] = [ fn, args, kwargs ]
+                return entry[3][3]
+
+            cmd = [ fn, args, kwargs, Future() ]
+            entry = self._pending[key] = (priority, next(self._seq), key, cmd, devices)
+
+        if window > 0:
+            timer = threading.Timer(window, self._queue.put, (entry,))
+            timer.daemon = True
+            timer.start()
+        else:
+            self._queue.put(entry)
+
+        return cmd[3]
+
+    def call(self, fn, *args, **kwargs):
+        return self.submit(fn, *args, **kwargs).result()
+
+    def _take_pending(self, devices):
+        # Removes the coalesced commands that only use devices and have
+        # not started, and returns them oldest first
+        with self._pending_lock:
+            entries = [ e for e in self._pending.values() if set(e[4]) <= set(devices) ]
+
+            for e in entries:
+                del self._pending[e[2]]
+
+        return [ e[3] for e in sorted(entries, key=lambda e: e[1]) ]
+
+    def _run_pending(self, cmds, fn, *args, **kwargs):
+        for cmd in cmds:
+            self._execute(*cmd)
+
+        return fn(*args, **kwargs)
+
+    @staticmethod
+    def _execute(fn, args, kwargs, future):
+        if not future.set_running_or_notify_cancel():
+            return
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def _run(self):
+        while True:
+            entry = self._queue.get()
+            priority, seq, key, cmd, devices = entry
+
+            if key is not None:
+                with self._pending_lock:
+                    # Already run by a flushing command
+                    if self._pending.get(key) is not entry:
+                        continue
+
+                    del self._pending[key]
+
+            # Always taken in sorted order, so workers cannot deadlock
+            locks = [ self._locks[d] for d in devices ]
+
+            for lock in locks:
+                lock.acquire()
+
+            try:
+                self._execute(*cmd)
+            finally:
+                for lock in reversed(locks):
+                    lock.release()
@@ -0,0 +1,283 @@
+import threading
+import time
+
+from abc import ABC, abstractmethod
+
+
+class SimSPI(ABC):
+    """A simulated chip on a spidev node.  Frames go through transfer()
+    one at a time, exactly as the drivers clock them out; frames and
+    bytes are counted for the benchmarks."""
+    def __init__(self, path):
+        self.devpath = path
+        self.frames = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def transfer(self, data):
+        data = list(data)
+
+        with self._lock:
+            self.frames += 1
+            self.bytes += len(data)
+
+            return self.frame(data)
+
+    @abstractmethod
+    def frame(self, data):
+        # Takes one frame's MOSI bytes and returns its MISO bytes
+        pass
+
+    def close(self):
+        pass
+
+
+class SimLMX2820(SimSPI):
+    """LMX2820 register file with lock detect.
+
+    Writing R0 applies the double-buffered PLL registers.  With FCAL_EN
+    the part goes out of lock for CAL_TIME while the VCO calibrates; with
+    FCAL off and INSTACAL on it relocks after INSTACAL_TIME.  Changing
+    the PLL without either leaves it unlocked.  R74/R75 read back lock
+    detect and the VCO band, capcode and DAC setting calibration picked,
+    or the forced ones.
+    """
+    NUM_REGS = 113
+    READBACK_REGS = ( 74, 75, 76 )
+    PLL_REGS = range(36, 46)
+
+    CAL_TIME = 200e-6
+    INSTACAL_TIME = 5e-6
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.regs = [ 0 ] * self.NUM_REGS
+        self.fcals = 0
+
+        self._locked_at = None
+        self._pll_changed = False
+
+    @property
+    def locked(self):
+        return self._locked_at is not None and time.monotonic() >= self._locked_at
+
+    def _vco(self):
+        # (band, capcode, DAC) the VCO ends up at for the current N.
+        # Calibration settles in the band the driver asked for.
+        r = self.regs
+        n = r[36]
+
+        vco_sel = (r[22] >> 13) & 0x7
+        capctrl = r[22] & 0xFF if r[10] & (1 << 7) else (n * 7) & 0xFF
+        daciset = r[20] & 0x1FF if r[10] & (1 << 11) else (n * 13) & 0x1FF
+
+        return vco_sel, capctrl, daciset
+
+    def _write(self, addr, v):
+        if addr >= self.NUM_REGS or addr in self.READBACK_REGS:
+            return
+
+        if addr == 0:
+            self._r0(v)
+            return
+
+        if addr in self.PLL_REGS and self.regs[addr] != v:
+            self._pll_changed = True
+
+        self.regs[addr] = v
+
+    def _r0(self, v):
+        if v & (1 << 1):
+            # RESET: back to power-on state
+            self.regs = [ 0 ] * self.NUM_REGS
+            self._locked_at = None
+            self._pll_changed = False
+            return
+
+        self.regs[0] = v
+
+        now = time.monotonic()
+
+        if v & (1 << 4):
+            self.fcals += 1
+            self._locked_at = now + self.CAL_TIME
+        elif self.regs[1] & 0x1:
+            self._locked_at = now + self.INSTACAL_TIME
+        elif self._pll_changed:
+            self._locked_at = None
+
+        self._pll_changed = False
+
+    def _read(self, addr):
+        if addr == 74:
+            vco_sel, capctrl, daciset = self._vco()
+            return (vco_sel << 13) | (capctrl << 5) | (2 if self.locked else 0)
+
+        if addr == 75:
+            return self._vco()[2]
+
+        if addr == 76:
+            return 0
+
+        return self.regs[addr] if addr < self.NUM_REGS else 0
+
+    def frame(self, data):
+        addr = data[0] & 0x7F
+
+        if data[0] & 0x80:
+            v = self._read(addr)
+            return [ 0, v >> 8, v & 0xFF ]
+
+        self._write(addr, (data[1] << 8) | data[2])
+
+        return [ 0, 0, 0 ]
+
+
+class SimLTC5594(SimSPI):
+    NUM_REGS = 0x18
+
+    # Power-on contents
+    DEFAULTS = [
+        0x80, 0x80, 0x80, 0x80, 0x80, 0x80, 0x80, 0x80,
+        0x80, 0x80, 0x80, 0x80, 0x80, 0x80, 0x80, 0x80,
+        0x04, 0x82, 0x48, 0xE3, 0x6A, 0x00, 0xF0, 0x01,
+    ]
+
+    # Chip ID, read only
+    REG_CID = 0x17
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.regs = list(self.DEFAULTS)
+
+    def frame(self, data):
+        addr = data[0] & 0x7F
+
+        if data[0] & 0x80:
+            return [ 0, self.regs[addr] if addr < self.NUM_REGS else 0 ]
+
+        if addr < self.NUM_REGS and addr != self.REG_CID:
+            self.regs[addr] = data[1]
+
+        return [ 0, 0 ]
+
+
+class SimLTC2668(SimSPI):
+    """16 channel DAC with separate input and DAC registers."""
+    NUM_CHANNELS = 16
+
+    # Output range of each span code, in volts
+    SPANS = {
+        0x0: ( 0, 5 ),
+        0x1: ( 0, 10 ),
+        0x2: ( -5, 5 ),
+        0x3: ( -10, 10 ),
+        0x4: ( -2.5, 2.5 ),
+    }
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.inputs = [ 0 ] * self.NUM_CHANNELS
+        self.codes = [ 0 ] * self.NUM_CHANNELS
+        self.spans = [ 0 ] * self.NUM_CHANNELS
+        self.updates = 0
+
+    def voltage(self, channel):
+        lo, hi = self.SPANS[self.spans[channel]]
+
+        return lo + self.codes[channel] / 65535 * (hi - lo)
+
+    def _update(self, channels):
+        self.updates += 1
+
+        for c in channels:
+            self.codes[c] = self.inputs[c]
+
+    def frame(self, data):
+        cmd = data[0] & 0xF0
+        n = data[0] & 0x0F
+        code = (data[1] << 8) | data[2]
+        all_channels = range(self.NUM_CHANNELS)
+
+        if cmd in ( 0x00, 0x20, 0x30 ):
+            self.inputs[n] = code
+        elif cmd in ( 0x80, 0xA0 ):
+            self.inputs = [ code ] * self.NUM_CHANNELS
+        elif cmd == 0x60:
+            self.spans[n] = data[2] & 0x7
+        elif cmd == 0xE0:
+            self.spans = [ data[2] & 0x7 ] * self.NUM_CHANNELS
+
+        if cmd in ( 0x10, 0x30 ):
+            self._update([ n ])
+        elif cmd in ( 0x20, 0x90, 0xA0 ):
+            self._update(all_channels)
+
+        return [ 0, 0, 0 ]
+
+
+class SimADRF6520(SimSPI):
+    def __init__(self, path):
+        super().__init__(path)
+        self.control = 0
+
+    def frame(self, data):
+        if data[1] == 0x10:
+            self.control = data[2]
+
+        return [ 0, 0, 0 ]
+
+
+class SimGPIO:
+    def __init__(self, line):
+        self._line = line
+
+    def read(self):
+        return self._line['value']
+
+    def write(self, value):
+        self._line['value'] = bool(value)
+
+    def poll(self, timeout=None):
+        # No edges are ever simulated
+        if timeout:
+            time.sleep(timeout)
+
+        return False
+
+    def close(self):
+        pass
+
+
+class SimBackend:
+    """Simulated board.  Each (node, chip) is simulated once and shared
+    by everything that opens it, like the real device would be."""
+    CHIPS = {
+        'lmx2820': SimLMX2820,
+        'ltc5594': SimLTC5594,
+        'ltc2668': SimLTC2668,
+        'adrf6520': SimADRF6520,
+    }
+
+    def __init__(self):
+        self.devices = {}
+        self.lines = {}
+        self._lock = threading.Lock()
+
+    def spi(self, path, chip, mode=0, max_speed=1000000):
+        with self._lock:
+            key = (path, chip)
+
+            if key not in self.devices:
+                self.devices[key] = self.CHIPS[chip](path)
+
+            return self.devices[key]
+
+    def gpio(self, path, line, direction):
+        with self._lock:
+            state = self.lines.setdefault((path, line), { 'value': False })
+
+            if direction in ( "high", "low" ):
+                state['value'] = direction == "high"
+
+            return SimGPIO(state)
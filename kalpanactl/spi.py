@@ -0,0 +1,136 @@
+import ctypes
+import fcntl
+
+from .metrics import SPI_FRAMES, SPI_BYTES
+from .trace import span
+
+# struct spi_ioc_transfer from linux/spi/spidev.h
+class _SpiIocTransfer(ctypes.Structure):
+    _fields_ = [
+        ('tx_buf', ctypes.c_ulonglong),
+        ('rx_buf', ctypes.c_ulonglong),
+        ('len', ctypes.c_uint),
+        ('speed_hz', ctypes.c_uint),
+        ('delay_usecs', ctypes.c_ushort),
+        ('bits_per_word', ctypes.c_ubyte),
+        ('cs_change', ctypes.c_ubyte),
+        ('tx_nbits', ctypes.c_ubyte),
+        ('rx_nbits', ctypes.c_ubyte),
+        ('word_delay_usecs', ctypes.c_ubyte),
+        ('pad', ctypes.c_ubyte),
+    ]
+
+_SPI_IOC_MAGIC = ord('k')
+_IOC_SIZEBITS = 14
+
+# SPI_MSGSIZE(n) has to fit in the ioctl size field
+MAX_FRAMES = ((1 << _IOC_SIZEBITS) - 1) // ctypes.sizeof(_SpiIocTransfer)
+
+
+def _spi_ioc_message(n):
+    # _IOW(SPI_IOC_MAGIC, 0, char[SPI_MSGSIZE(n)])
+    return (1 << 30) | ((n * ctypes.sizeof(_SpiIocTransfer)) << 16) | (_SPI_IOC_MAGIC << 8)
+
+
+def _submit(fd, frames):
+    n = len(frames)
+    size = sum(len(f) for f in frames)
+
+    tx = ctypes.create_string_buffer(bytes(b for f in frames for b in f), size)
+    rx = ctypes.create_string_buffer(size)
+
+    xfers = (_SpiIocTransfer * n)()
+
+    offset = 0
+    for i, f in enumerate(frames):
+        xfers[i].tx_buf = ctypes.addressof(tx) + offset
+        xfers[i].rx_buf = ctypes.addressof(rx) + offset
+        xfers[i].len = len(f)
+        # Drop CS between frames; the last one is released by the
+        # kernel at the end of the message anyway
+        xfers[i].cs_change = 1 if i < n - 1 else 0
+        offset += len(f)
+
+    fcntl.ioctl(fd, _spi_ioc_message(n), xfers)
+
+    retval = []
+    offset = 0
+    for f in frames:
+        retval.append(list(rx.raw[offset:offset + len(f)]))
+        offset += len(f)
+
+    return retval
+
+
+def transfer_frames(spi, frames):
+    """Clock out a list of frames, each with its own CS assertion, in
+    as few kernel calls as possible.  Returns the MISO bytes for every
+    frame.
+
+    Devices that do not expose a spidev file descriptor fall back to
+    one transfer() per frame."""
+    frames = [ list(f) for f in frames ]
+
+    if not frames:
+        return []
+
+    _count(spi, len(frames), sum(len(f) for f in frames))
+
+    fd = getattr(spi, 'fd', None)
+
+    with span("spi", frames=len(frames)):
+        if fd is None:
+            return [ spi.transfer(f) for f in frames ]
+
+        retval = []
+        for i in range(0, len(frames), MAX_FRAMES):
+            retval += _submit(fd, frames[i:i + MAX_FRAMES])
+
+        return retval
+
+
+def _count(spi, frames, nbytes):
+    device = getattr(spi, 'devpath', None) or type(spi).__name__
+
+    SPI_FRAMES.inc(device, n=frames)
+    SPI_BYTES.inc(device, n=nbytes)
+
+
+def transfer(spi, data):
+    # A single frame, counted like transfer_frames()
+    _count(spi, 1, len(data))
+
+    return spi.transfer(data)
+
+
+class SPITransaction:
+    """Queues register writes for one device and submits them as a
+    single SPI message:
+
+        with SPITransaction(spi) as t:
+            t.write([ 0x01, 0x02, 0x03 ])
+            t.write([ 0x00, 0x02, 0x03 ])
+    """
+    def __init__(self, spi):
+        self._spi = spi
+        self._frames = []
+
+    def __len__(self):
+        return len(self._frames)
+
+    def write(self, data):
+        self._frames.append(data)
+
+    def submit(self):
+        frames, self._frames = self._frames, []
+
+        return transfer_frames(self._spi, frames)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.submit()
+        else:
+            self._frames = []
@@ -0,0 +1,110 @@
+import contextlib
+import functools
+import os
+import threading
+import time
+
+from collections import deque
+
+
+class Tracer:
+    """Opt-in timeline of what the daemon spends its time on.
+
+    While enabled, every span() records (name, start, end, thread, args)
+    into a ring of the last capacity spans.  Spans nest simply by being
+    opened inside one another.  chrome_trace() exports the ring in the
+    Chrome trace event format, which chrome://tracing and
+    ui.perfetto.dev open directly.  While disabled, span() hands back a
+    shared no-op context manager, so instrumented code pays one call.
+    """
+    def __init__(self, capacity=100000):
+        self._enabled = False
+        self._spans = deque(maxlen=capacity)
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    def enable(self, capacity=None):
+        if capacity is not None and capacity != self._spans.maxlen:
+            self._spans = deque(self._spans, maxlen=capacity)
+
+        self._enabled = True
+
+    def disable(self):
+        self._enabled = False
+
+    def clear(self):
+        self._spans.clear()
+
+    def span(self, name, **args):
+        if not self._enabled:
+            return _NULL
+
+        return _Span(self._spans, name, args)
+
+    def traced(self, name=None):
+        # Decorator wrapping every call in a span
+        def decorator(fn):
+            label = name or fn.__qualname__
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self._enabled:
+                    return fn(*args, **kwargs)
+
+                with _Span(self._spans, label, {}):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        threads = {}
+        events = []
+
+        for name, start, end, thread, args in list(self._spans):
+            threads[thread.ident] = thread.name
+
+            events.append({
+                'name': name,
+                'ph': 'X',
+                'ts': start / 1e3,
+                'dur': (end - start) / 1e3,
+                'pid': pid,
+                'tid': thread.ident,
+                'args': args,
+            })
+
+        for tid, name in threads.items():
+            events.append({ 'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                            'args': { 'name': name } })
+
+        return { 'traceEvents': events, 'displayTimeUnit': 'ns' }
+
+
+_NULL = contextlib.nullcontext()
+
+
+class _Span:
+    __slots__ = ( '_spans', '_name', '_args', '_start' )
+
+    def __init__(self, spans, name, args):
+        self._spans = spans
+        self._name = name
+        self._args = args
+
+    def __enter__(self):
+        self._start = time.monotonic_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._spans.append((self._name, self._start, time.monotonic_ns(),
+                            threading.current_thread(), self._args))
+
+
+tracer = Tracer()
+span = tracer.span
+traced = tracer.traced
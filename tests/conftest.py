@@ -0,0 +1,33 @@
+import pytest
+
+from kalpanactl import Kalpana
+from kalpanactl import backend
+from kalpanactl.sim import SimLMX2820
+
+
+@pytest.fixture
+def fast_lock(monkeypatch):
+    # Simulated LMXs lock as soon as they are programmed
+    monkeypatch.setattr(SimLMX2820, "CAL_TIME", 0)
+    monkeypatch.setattr(SimLMX2820, "INSTACAL_TIME", 0)
+
+
+@pytest.fixture
+def conf(tmp_path, monkeypatch):
+    path = tmp_path / "kalpana.conf"
+    monkeypatch.setattr(Kalpana, "CONFIG_PATH", path)
+
+    return path
+
+
+@pytest.fixture
+def kalpana(conf, fast_lock, monkeypatch):
+    # A freshly powered simulated board for every test
+    monkeypatch.setattr(backend, "_instances", {})
+
+    if not conf.exists():
+        conf.write_text('{ "ref_settle": 0.0 }')
+
+    k = Kalpana(backend="sim")
+    yield k
+    k.flush_config()
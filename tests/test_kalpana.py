@@ -0,0 +1,110 @@
+import json
+
+import pytest
+
+from kalpanactl import Kalpana
+from kalpanactl import backend
+from kalpanactl.sim import SimLMX2820
+
+
+def test_set_los(kalpana):
+    lock_a, lock_b = kalpana.set_LOs(2.4e9, 3.1e9)
+
+    assert lock_a is not None and lock_b is not None
+    assert kalpana.get_a_LO() == 2.4e9
+    assert kalpana.get_b_LO() == 3.1e9
+    assert kalpana.LO_A.locked and kalpana.LO_B.locked
+
+
+def test_retune_timeout_keeps_configuration(kalpana, monkeypatch):
+    changes = []
+    kalpana.subscribe(changes.append)
+
+    monkeypatch.setattr(SimLMX2820, "CAL_TIME", 1)
+
+    with pytest.raises(TimeoutError):
+        kalpana.set_a_LO(2.5e9)
+
+    assert kalpana.get_a_LO() == 1e9
+    assert kalpana._config.f_a_lo == 1e9
+    assert changes == []
+
+
+def test_gains_need_a_dac(kalpana):
+    with pytest.raises(AssertionError):
+        kalpana.set_gain('rx0', 10)
+
+    assert kalpana.dac is None
+
+
+def test_apply_state_checks_everything_first(kalpana):
+    with pytest.raises(AssertionError):
+        kalpana.apply_state({ 'f_a_lo': 2.4e9, 'tx_i_gain': 3 })
+
+    assert kalpana.get_a_LO() == 1e9
+
+
+def test_configuration_is_saved(kalpana, conf):
+    kalpana.set_i_gain('tx', 0.25)
+
+    assert kalpana.flush_config()
+    assert '"tx_i_gain": 0.25' in conf.read_text()
+
+
+def test_locked_lo_is_kept_when_the_other_times_out(kalpana, monkeypatch):
+    monkeypatch.setattr(kalpana.backend.devices[("/dev/spidev1.3", "lmx2820")], "CAL_TIME", 1)
+
+    with pytest.raises(TimeoutError, match="B LO"):
+        kalpana.set_LOs(2.4e9, 3.1e9)
+
+    assert kalpana.get_a_LO() == 2.4e9
+    assert kalpana.get_b_LO() != 3.1e9
+    assert kalpana.ltc5594[0]._band_entry == kalpana.ltc5594[0].band_entry(2.4e9)
+
+
+@pytest.fixture
+def gain_table(conf, tmp_path):
+    # As written by ADRF6520GainCurve/combine.py
+    path = tmp_path / "gain_lookup.csv"
+    path.write_text("0.0,0.000\n10.0,0.500\n20.0,1.000\n")
+
+    conf.write_text(json.dumps({ 'ref_settle': 0.0, 'gain_dac': "/dev/spidev0.0", 'gain_table': str(path) }))
+
+    return path
+
+
+def test_gain_table_from_csv(gain_table, kalpana):
+    assert kalpana.gain_table.gain_range == (0.0, 20.0)
+
+    kalpana.set_gain('rx0', 15)
+
+    dac = kalpana.backend.devices[("/dev/spidev0.0", "ltc2668")]
+    assert dac.voltage(kalpana._config.gain_channels['rx0']) == pytest.approx(0.75, abs=1e-3)
+
+    with pytest.raises(AssertionError):
+        kalpana.set_gain('rx0', 30)
+
+
+def test_gains_are_programmed_at_startup(conf, fast_lock, monkeypatch):
+    monkeypatch.setattr(backend, "_instances", {})
+
+    conf.write_text(json.dumps({ 'ref_settle': 0.0, 'gain_dac': "/dev/spidev0.0", 'gain': { 'tx1': 30.0 } }))
+
+    k = Kalpana(backend="sim")
+
+    dac = k.backend.devices[("/dev/spidev0.0", "ltc2668")]
+    assert dac.voltage(k._config.gain_channels['tx1']) == pytest.approx(k.gain_table.gain_to_voltage(30.0), abs=1e-3)
+
+
+def test_gain_channels_are_configurable(conf, fast_lock, monkeypatch):
+    monkeypatch.setattr(backend, "_instances", {})
+
+    conf.write_text(json.dumps({ 'ref_settle': 0.0, 'gain_dac': "/dev/spidev0.0",
+                                 'gain_channels': { 'rx0': 8, 'rx1': 9, 'tx0': 10, 'tx1': 11 } }))
+
+    k = Kalpana(backend="sim")
+    k.set_gain('rx1', 40)
+
+    dac = k.backend.devices[("/dev/spidev0.0", "ltc2668")]
+    assert dac.voltage(9) == pytest.approx(k.gain_table.gain_to_voltage(40.0), abs=1e-3)
+    assert dac.codes[1] == 0
@@ -0,0 +1,36 @@
+import json
+
+import pytest
+
+from kalpanactl import kalpanactld
+from kalpanactl.scheduler import HardwareScheduler
+
+
+@pytest.fixture
+def client(kalpana, monkeypatch):
+    monkeypatch.setattr(kalpanactld, "kalpana", kalpana)
+    monkeypatch.setattr(kalpanactld, "hw", HardwareScheduler(kalpanactld.DEVICES))
+
+    return kalpanactld.flask_app.test_client()
+
+
+def test_set_lo(client):
+    r = client.put("/a_lo?freq=2.4e9")
+
+    assert json.loads(r.data) == { 'frequency': 2.4e9 }
+
+
+@pytest.mark.parametrize("lo", [ "a_lo", "b_lo" ])
+def test_bad_frequency_reports_error(client, lo):
+    r = client.put(f"/{lo}?freq=fast")
+
+    assert r.status_code == 400
+    assert b"Failed to set new frequency" in r.data
+
+
+@pytest.mark.parametrize("path", [ "/a_lo?freq=5e9", "/b_lo?freq=1e8", "/los?a=2e9&b=5e9" ])
+def test_out_of_range_frequency_says_why(client, path):
+    r = client.put(path)
+
+    assert r.status_code == 400
+    assert b"must be between 400MHz and 4.4GHz" in r.data
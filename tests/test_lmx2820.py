@@ -0,0 +1,98 @@
+import pytest
+
+from kalpanactl import lmx2820
+from kalpanactl.lmx2820 import LMX2820
+from kalpanactl.sim import SimLMX2820
+
+
+@pytest.fixture
+def sim():
+    return SimLMX2820("lmx")
+
+
+@pytest.fixture
+def lmx(sim):
+    return LMX2820(sim, f_outa=2e9)
+
+
+def test_program_writes_only_changed_registers(sim, lmx):
+    lmx.program()
+    assert sim.frames == LMX2820.NUM_REGS
+
+    lmx.set_fout(2.45e9)
+    frames = sim.frames
+    lmx.program()
+    assert 0 < sim.frames - frames < 10
+
+    frames = sim.frames
+    lmx.program()
+    assert sim.frames == frames
+
+    assert sim.regs[1:] == lmx.image()[1:]
+
+
+def test_lock_after_calibration(fast_lock, sim, lmx):
+    lmx.program()
+
+    assert sim.fcals == 1
+    assert lmx.wait_lock(0.01) >= 0
+    assert lmx.locked
+
+
+def test_wait_lock_times_out(sim, lmx, monkeypatch):
+    monkeypatch.setattr(SimLMX2820, "CAL_TIME", 1)
+
+    lmx.program()
+
+    with pytest.raises(TimeoutError):
+        lmx.wait_lock(0.005)
+
+
+def test_hop_skips_calibration(fast_lock, sim, lmx):
+    lmx.program()
+
+    assert lmx.calibrate_hops([ 2.4e9, 2.5e9 ]) == [ 2.4e9, 2.5e9 ]
+    assert lmx.fout == 2e9
+
+    fcals = sim.fcals
+
+    assert lmx.hop(1) == 2.5e9
+    lmx.wait_lock(0.01)
+    assert lmx.hop(0) == 2.4e9
+    lmx.wait_lock(0.01)
+
+    assert sim.fcals == fcals
+
+    # Leaving hop mode calibrates normally again
+    lmx.set_fout(2e9)
+    lmx.program()
+    assert sim.fcals == fcals + 1
+
+
+def test_warm_start_reads_back(fast_lock, sim, lmx):
+    lmx.program()
+
+    again = LMX2820(sim, f_outa=2e9)
+    again.warm_start()
+
+    assert again.in_sync
+
+
+def test_read_image_is_one_message(sim, lmx, monkeypatch):
+    lmx.program()
+
+    calls = []
+    real = lmx2820.transfer_frames
+
+    def transfer_frames(spi, frames):
+        calls.append(len(frames))
+        return real(spi, frames)
+
+    monkeypatch.setattr(lmx2820, "transfer_frames", transfer_frames)
+
+    frames = sim.frames
+    image = lmx.read_image()
+
+    assert calls == [ LMX2820.NUM_REGS ]
+    assert sim.frames - frames == LMX2820.NUM_REGS
+    assert image[1:74] == sim.regs[1:74]
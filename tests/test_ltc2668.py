@@ -0,0 +1,40 @@
+from kalpanactl.ltc2668 import LTC2668
+from kalpanactl.sim import SimLTC2668
+
+
+def test_staged_channels_update_together():
+    sim = SimLTC2668("dac")
+    dac = LTC2668(sim)
+
+    dac.stage(0, 1.0)
+    dac.stage(3, -1.0)
+
+    assert sim.frames == 0
+
+    dac.update()
+
+    assert sim.updates == 1
+    assert abs(sim.voltage(0) - 1.0) < 1e-3
+    assert abs(sim.voltage(3) + 1.0) < 1e-3
+
+
+def test_spans_are_only_written_once():
+    sim = SimLTC2668("dac")
+    dac = LTC2668(sim)
+
+    dac.setVs({ 0: 0.5, 1: 0.5 })
+    frames = sim.frames
+
+    dac.setVs({ 0: 0.25, 1: -0.25 })
+
+    # Two codes, no span writes
+    assert sim.frames - frames == 2
+    assert abs(sim.voltage(1) + 0.25) < 1e-3
+
+
+def test_update_without_staged_codes_writes_nothing():
+    sim = SimLTC2668("dac")
+
+    LTC2668(sim).update()
+
+    assert sim.frames == 0
@@ -0,0 +1,19 @@
+from kalpanactl.ltc5594 import LTC5594
+from kalpanactl.sim import SimLTC5594
+
+
+def test_warm_start_writes_nothing():
+    sim = SimLTC5594("ltc")
+
+    ltc = LTC5594(sim)
+    ltc.set_freq(2.4e9)
+    ltc.program()
+
+    again = LTC5594(sim, warm=True)
+    again.set_freq(2.4e9)
+
+    frames = sim.frames
+    again.program()
+    assert sim.frames == frames
+
+    assert sim.regs[LTC5594.REG_CID] == SimLTC5594.DEFAULTS[LTC5594.REG_CID]
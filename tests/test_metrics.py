@@ -0,0 +1,34 @@
+import threading
+
+from kalpanactl import metrics
+
+
+def test_render_mixed_labels():
+    registry = metrics.Registry()
+    h = metrics.Histogram("h", "h", [ "route", "status" ], registry=registry)
+
+    h.observe(0.001, None, 404)
+    h.observe(0.001, "state", "200")
+    h.observe(0.001, "state", 200)
+
+    text = registry.render()
+
+    assert text.count("h_count") == 3
+    assert 'h_count{route="None",status="404"} 1' in text
+
+
+def test_counter_sums_threads():
+    registry = metrics.Registry()
+    c = metrics.Counter("c", "c", [ "device" ], registry=registry)
+
+    threads = [ threading.Thread(target=c.inc, args=("spi",), kwargs={ 'n': 2 }) for i in range(4) ]
+
+    for t in threads:
+        t.start()
+
+    for t in threads:
+        t.join()
+
+    c.inc("spi")
+
+    assert 'c{device="spi"} 9' in registry.render()
@@ -0,0 +1,78 @@
+import time
+
+from kalpanactl import persist
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_write_replaces_file(tmp_path):
+    path = tmp_path / "kalpana.conf"
+    p = persist.ConfigPersister(path, lambda: "{}")
+
+    p.schedule()
+    assert p.flush()
+
+    assert path.read_text() == "{}"
+    assert list(tmp_path.iterdir()) == [ path ]
+
+
+def test_write_in_place_without_directory_access(tmp_path, monkeypatch):
+    path = tmp_path / "kalpana.conf"
+    path.write_text("old")
+
+    monkeypatch.setattr(persist.os, "access", lambda *args: False)
+
+    def replace(*args):
+        raise AssertionError("replaced the file")
+
+    monkeypatch.setattr(persist.os, "replace", replace)
+
+    p = persist.ConfigPersister(path, lambda: "new")
+    p.schedule()
+
+    assert p.flush()
+    assert path.read_text() == "new"
+
+
+def test_gives_up_after_repeated_failures(tmp_path):
+    attempts = []
+
+    def dump():
+        attempts.append(1)
+        raise PermissionError("denied")
+
+    p = persist.ConfigPersister(tmp_path / "kalpana.conf", dump, min_interval=0.01, max_failures=3)
+    p.schedule()
+
+    wait_for(lambda: p.failures == 3)
+    time.sleep(0.1)
+
+    assert len(attempts) == 3
+    assert "denied" in p.error
+
+
+def test_error_clears_after_a_successful_write(tmp_path):
+    fail = [ True ]
+
+    def dump():
+        if fail[0]:
+            raise PermissionError("denied")
+
+        return "{}"
+
+    p = persist.ConfigPersister(tmp_path / "kalpana.conf", dump, min_interval=0.01, max_failures=1)
+
+    p.schedule()
+    wait_for(lambda: p.failures == 1)
+
+    fail[0] = False
+    p.schedule()
+    wait_for(lambda: p.error is None)
+
+    assert p.failures == 0
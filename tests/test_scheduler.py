@@ -0,0 +1,63 @@
+import threading
+import time
+
+from kalpanactl.scheduler import HardwareScheduler
+
+
+def blocked(hw, device):
+    # Keeps the worker busy on device until the returned event is set
+    release = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait()
+
+    hw.submit(block, devices=( device, ))
+    started.wait()
+
+    return release
+
+
+def test_coalesce_applies_latest_once():
+    hw = HardwareScheduler([ 'ltc' ])
+    applied = []
+
+    release = blocked(hw, 'ltc')
+
+    futures = [ hw.coalesce('i_gain', applied.append, v, devices=( 'ltc', ), window=0) for v in range(10) ]
+
+    release.set()
+    futures[-1].result(1)
+
+    assert applied == [ 9 ]
+    assert all(f is futures[0] for f in futures)
+
+
+def test_coalesce_after_start_queues_again():
+    hw = HardwareScheduler([ 'ltc' ])
+    applied = []
+
+    hw.coalesce('i_gain', applied.append, 1, devices=( 'ltc', ), window=0).result(1)
+    hw.coalesce('i_gain', applied.append, 2, devices=( 'ltc', ), window=0).result(1)
+
+    assert applied == [ 1, 2 ]
+
+
+def test_flush_runs_pending_first():
+    hw = HardwareScheduler([ 'ltc', 'dac' ])
+    applied = []
+
+    pending = hw.coalesce('i_gain', applied.append, 'slider', devices=( 'ltc', ), window=0.05)
+    other = hw.coalesce('gain', applied.append, 'gain', devices=( 'dac', ), window=0.05)
+
+    hw.call(applied.append, 'state', devices=( 'ltc', ), priority=hw.PRIO_RETUNE, flush=True)
+
+    assert applied == [ 'slider', 'state' ]
+    assert pending.done()
+
+    # Only commands on the flushed devices are taken, and nothing runs twice
+    other.result(1)
+    time.sleep(0.1)
+
+    assert applied == [ 'slider', 'state', 'gain' ]
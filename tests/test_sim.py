@@ -0,0 +1,19 @@
+import pytest
+
+from kalpanactl.sim import SimSPI
+
+
+def test_chips_must_implement_frame():
+    class Chip(SimSPI):
+        pass
+
+    with pytest.raises(TypeError):
+        Chip("chip")
+
+    class Echo(SimSPI):
+        def frame(self, data):
+            return data
+
+    chip = Echo("chip")
+    assert chip.transfer([ 1, 2 ]) == [ 1, 2 ]
+    assert (chip.frames, chip.bytes) == (1, 2)